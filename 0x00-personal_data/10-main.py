@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Main file: per-record cost of redacting the whole formatted line, with
+logging.Formatter, against redacting the message only, with the time
+cached per second. Both cost about the same (within a few percent, run to
+run): redacting the message only keeps the logger name and time out of
+the regex, it is not a speedup.
+"""
+
+import logging
+import timeit
+
+filtered_logger = __import__('filtered_logger')
+RedactingFormatter = filtered_logger.RedactingFormatter
+PII_FIELDS = filtered_logger.PII_FIELDS
+
+
+class WholeLineFormatter(logging.Formatter):
+    """The previous behaviour: format everything with logging.Formatter,
+    then redact the line, with the same compiled redactor."""
+
+    def __init__(self, fields):
+        """Initializes the formatter with RedactingFormatter's FORMAT."""
+        super(WholeLineFormatter, self).__init__(RedactingFormatter.FORMAT)
+        self.redactor = filtered_logger.get_redactor(
+            fields, RedactingFormatter.REDACTION,
+            RedactingFormatter.SEPARATOR)
+
+    def format(self, record: logging.LogRecord) -> str:
+        """Formats the record with logging.Formatter and redacts it."""
+        return self.redactor.redact(
+            super(WholeLineFormatter, self).format(record))
+
+
+message = "name=Marlene Wood;email=hwestiii@att.net;phone=(473) 401-4253;" \
+    "ssn=261-72-6780;password=K5?BMNv;ip=60ed:c396:2ff:244:bbd0:9208:26f2;" \
+    "last_login=2019-11-14 06:14:24;user_agent=Mozilla/5.0 (Windows NT 10.0);"
+records = [logging.LogRecord("user_data", logging.INFO, None, None, message,
+                             None, None) for _ in range(10000)]
+old, new = WholeLineFormatter(PII_FIELDS), RedactingFormatter(PII_FIELDS)
+assert old.format(records[0]) == new.format(records[0])
+
+# Alternate the formatters so that noise affects both alike
+formatters = (("whole line", old), ("message only", new))
+best = {name: float("inf") for name, _ in formatters}
+for _ in range(20):
+    for name, formatter in formatters:
+        seconds = timeit.timeit(
+            lambda: [formatter.format(record) for record in records],
+            number=1)
+        best[name] = min(best[name], seconds)
+for name, seconds in best.items():
+    print("{:<14} {:8.3f} us/record".format(
+        name, seconds / len(records) * 1e6))
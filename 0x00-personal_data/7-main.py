@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Main file: per-line cost of re.sub with a rebuilt pattern against the
+compiled Redactor used by filter_datum.
+"""
+
+import re
+import timeit
+
+filtered_logger = __import__('filtered_logger')
+patterns = filtered_logger.patterns
+PII_FIELDS = filtered_logger.PII_FIELDS
+get_redactor = filtered_logger.get_redactor
+
+message = "name=Marlene Wood;email=hwestiii@att.net;phone=(473) 401-4253;" \
+    "ssn=261-72-6780;password=K5?BMNv;ip=60ed:c396:2ff:244:bbd0:9208:26f2;" \
+    "last_login=2019-11-14 06:14:24;user_agent=Mozilla/5.0 (Windows NT 10.0);"
+number = 100000
+
+
+def uncompiled() -> str:
+    """Redacts the line the way filter_datum used to."""
+    extract, replace = (patterns["extract"], patterns["replace"])
+    return re.sub(extract(PII_FIELDS, ';'), replace('***'), message)
+
+
+redactor = get_redactor(PII_FIELDS, '***', ';')
+assert uncompiled() == redactor.redact(message)
+
+for name, func in (("re.sub + pattern build", uncompiled),
+                   ("filter_datum", lambda: filtered_logger.filter_datum(
+                       PII_FIELDS, '***', message, ';')),
+                   ("Redactor.redact", lambda: redactor.redact(message))):
+    seconds = min(timeit.repeat(func, number=number, repeat=5))
+    print("{:<24} {:8.3f} us/line".format(name, seconds / number * 1e6))
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""
+Main file: runs main() on a SQLite copy of user_data.csv, twice over a
+connection pool.
+"""
+
+import os
+import tempfile
+
+filtered_logger = __import__('filtered_logger')
+
+db_path = os.path.join(tempfile.mkdtemp(), 'user_data.db')
+filtered_logger.init_sqlite_db(db_path, 'user_data.csv')
+os.environ['PERSONAL_DATA_DB_BACKEND'] = 'sqlite'
+os.environ['PERSONAL_DATA_DB_NAME'] = db_path
+
+get_db = filtered_logger.get_db
+db = get_db()
+print(db.execute("SELECT COUNT(*) FROM users;").fetchone()[0])
+db.close()
+
+pool = filtered_logger.ConnectionPool(size=2)
+for _ in range(2):
+    with pool.connection() as db:
+        filtered_logger.main(batch_size=5, db=db)
+pool.close()
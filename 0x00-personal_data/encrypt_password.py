@@ -3,28 +3,348 @@
 """
 
 
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
 import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 import bcrypt
 
 
-def hash_password(password: str) -> bytes:
-    """Hashes the provided password using bcrypt.
+# Work factor used until one is calibrated, the default of bcrypt.gensalt
+DEFAULT_COST = 12
+# Work factors accepted by bcrypt
+MIN_COST, MAX_COST = 4, 31
+# Lowest work factor calibration may pick or COST_FILE may hold, however
+# slow the machine
+MIN_SAFE_COST = int(os.getenv("BCRYPT_MIN_COST", 10))
+# File the calibrated work factor is persisted to
+COST_FILE = os.getenv("BCRYPT_COST_FILE", ".bcrypt_cost.json")
+# Work factor in use, loaded from COST_FILE on first use
+_cost = None
+# Threads hashing and checking passwords, bcrypt releases the GIL while it
+# works so they run in parallel
+_executor = None
+_workers = 1
+_executor_lock = threading.Lock()
+
+
+def calibrate_cost(target_ms: float = 250.0, persist: bool = True) -> int:
+    """Picks the highest bcrypt work factor whose hashing time on this
+    machine stays within a target latency.
+
+    Every extra unit of cost doubles the hashing time, so the cost is
+    raised from MIN_COST while twice the last measured time still fits in
+    the target. It never goes below MIN_SAFE_COST, even when that cost
+    takes longer than the target.
+
+    Args:
+        target_ms (float): The hashing latency to aim for, in milliseconds.
+        persist (bool): Whether to save the choice to COST_FILE for the
+        next processes.
+
+    Returns:
+        int: The chosen work factor, used by hash_password from now on.
+    """
+    global _cost
+    cost = MIN_SAFE_COST
+    elapsed_ms = _time_hash(cost)
+    while cost < MAX_COST and elapsed_ms * 2 <= target_ms:
+        cost += 1
+        elapsed_ms = _time_hash(cost)
+    if elapsed_ms > target_ms and cost > MIN_SAFE_COST:
+        cost -= 1
+    elif elapsed_ms > target_ms:
+        logging.warning("bcrypt cost %d takes %.0f ms, over the %.0f ms "
+                        "target", cost, elapsed_ms, target_ms)
+    if persist:
+        with open(COST_FILE, 'w') as f:
+            json.dump({'cost': cost, 'target_ms': target_ms}, f)
+    _cost = cost
+    return cost
+
+
+def _time_hash(cost: int) -> float:
+    """Returns the time, in milliseconds, of one hash at the given cost.
+    """
+    salt = bcrypt.gensalt(rounds=cost)
+    start = time.perf_counter()
+    bcrypt.hashpw(b'calibration password', salt)
+    return (time.perf_counter() - start) * 1000
+
+
+def get_cost() -> int:
+    """Returns the work factor used by hash_password.
+
+    Returns:
+        int: The calibrated work factor saved in COST_FILE, or DEFAULT_COST
+        (MIN_SAFE_COST if higher) if there is none or it is outside
+        MIN_SAFE_COST..MAX_COST.
+    """
+    global _cost
+    if _cost is None:
+        default = max(DEFAULT_COST, MIN_SAFE_COST)
+        try:
+            with open(COST_FILE, 'r') as f:
+                _cost = int(json.load(f)['cost'])
+        except (OSError, ValueError, KeyError, TypeError):
+            _cost = default
+        if not MIN_SAFE_COST <= _cost <= MAX_COST:
+            logging.warning("Ignoring bcrypt cost %d of %s, outside %d..%d",
+                            _cost, COST_FILE, MIN_SAFE_COST, MAX_COST)
+            _cost = default
+    return _cost
+
+
+class PasswordBackend:
+    """Base class of the password hashing schemes of BACKENDS.
+
+    A backend hashes passwords into self-describing byte strings (scheme,
+    parameters, salt and hash), recognizes its own hashes and tells when a
+    stored hash was made with weaker parameters than it is configured with.
+    """
+
+    name = None
+
+    def identify(self, hashed_password: bytes) -> bool:
+        """Tells whether a stored hash was made by this backend.
+        """
+        raise NotImplementedError
+
+    def hash(self, password: bytes) -> bytes:
+        """Salts and hashes an encoded password.
+        """
+        raise NotImplementedError
+
+    def verify(self, hashed_password: bytes, password: bytes) -> bool:
+        """Checks an encoded password against a hash of this backend.
+        """
+        raise NotImplementedError
+
+    def needs_rehash(self, hashed_password: bytes) -> bool:
+        """Tells whether a hash of this backend used weaker parameters than
+        the current ones.
+        """
+        raise NotImplementedError
+
+
+class BcryptBackend(PasswordBackend):
+    """bcrypt hashes, `$2b$<cost>$...`, at the calibrated work factor (see
+    get_cost).
+    """
+
+    name = "bcrypt"
+
+    def identify(self, hashed_password: bytes) -> bool:
+        """Tells whether a stored hash is a bcrypt hash.
+        """
+        return hashed_password.startswith((b"$2a$", b"$2b$", b"$2y$"))
+
+    def hash(self, password: bytes) -> bytes:
+        """Salts and hashes an encoded password with bcrypt.
+        """
+        return bcrypt.hashpw(password, bcrypt.gensalt(rounds=get_cost()))
+
+    def verify(self, hashed_password: bytes, password: bytes) -> bool:
+        """Checks an encoded password against a bcrypt hash.
+        """
+        return bcrypt.checkpw(password, hashed_password)
+
+    def needs_rehash(self, hashed_password: bytes) -> bool:
+        """Tells whether a bcrypt hash has a lower cost than get_cost().
+        """
+        return int(hashed_password.split(b"$")[2]) < get_cost()
+
+
+class ScryptBackend(PasswordBackend):
+    """hashlib.scrypt hashes, `$scrypt$ln=<log2 n>,r=<r>,p=<p>$salt$hash`.
+    """
+
+    name = "scrypt"
+
+    def __init__(self, ln: int = None, r: int = None, p: int = None):
+        """Initializes the backend, the parameters default to the SCRYPT_LN
+        (14), SCRYPT_R (8) and SCRYPT_P (1) environment variables.
+
+        Args:
+            ln (int): The log2 of the CPU/memory cost n.
+            r (int): The block size.
+            p (int): The parallelization factor.
+        """
+        self.ln = ln if ln is not None else int(os.getenv("SCRYPT_LN", 14))
+        self.r = r if r is not None else int(os.getenv("SCRYPT_R", 8))
+        self.p = p if p is not None else int(os.getenv("SCRYPT_P", 1))
+
+    def identify(self, hashed_password: bytes) -> bool:
+        """Tells whether a stored hash is a scrypt hash.
+        """
+        return hashed_password.startswith(b"$scrypt$")
+
+    def hash(self, password: bytes) -> bytes:
+        """Salts and hashes an encoded password with scrypt.
+        """
+        salt = os.urandom(16)
+        digest = self._derive(password, salt, self.ln, self.r, self.p)
+        return b"$scrypt$ln=%d,r=%d,p=%d$%s$%s" % (
+            self.ln, self.r, self.p, base64.b64encode(salt),
+            base64.b64encode(digest))
+
+    def verify(self, hashed_password: bytes, password: bytes) -> bool:
+        """Checks an encoded password against a scrypt hash.
+        """
+        (ln, r, p), salt, digest = self._parse(hashed_password)
+        return hmac.compare_digest(
+            self._derive(password, salt, ln, r, p, len(digest)), digest)
+
+    def needs_rehash(self, hashed_password: bytes) -> bool:
+        """Tells whether a scrypt hash has a lower n, r or p than the
+        backend.
+        """
+        ln, r, p = self._parse(hashed_password)[0]
+        return ln < self.ln or r < self.r or p < self.p
+
+    @staticmethod
+    def _parse(
+            hashed_password: bytes,
+    ) -> Tuple[Tuple[int, int, int], bytes, bytes]:
+        """Splits a scrypt hash into its parameters, salt and digest.
+        """
+        _, _, params, salt, digest = hashed_password.split(b"$")
+        values = dict(param.split(b"=") for param in params.split(b","))
+        return ((int(values[b"ln"]), int(values[b"r"]), int(values[b"p"])),
+                base64.b64decode(salt), base64.b64decode(digest))
+
+    @staticmethod
+    def _derive(password: bytes, salt: bytes, ln: int, r: int, p: int,
+                dklen: int = 64) -> bytes:
+        """Runs scrypt, allowing the memory the parameters need.
+        """
+        n = 1 << ln
+        return hashlib.scrypt(password, salt=salt, n=n, r=r, p=p,
+                              maxmem=128 * r * (n + p + 2), dklen=dklen)
+
+
+class PBKDF2Backend(PasswordBackend):
+    """hashlib.pbkdf2_hmac hashes,
+    `$pbkdf2-<digest>$<iterations>$salt$hash`.
+    """
+
+    name = "pbkdf2"
+
+    def __init__(self, iterations: int = None, digest: str = "sha256"):
+        """Initializes the backend.
+
+        Args:
+            iterations (int): The number of iterations, defaults to the
+            PBKDF2_ITERATIONS environment variable or 600000.
+            digest (str): The HMAC digest, a hashlib algorithm name.
+        """
+        if iterations is None:
+            iterations = int(os.getenv("PBKDF2_ITERATIONS", 600000))
+        self.iterations = iterations
+        self.digest = digest
+
+    def identify(self, hashed_password: bytes) -> bool:
+        """Tells whether a stored hash is a PBKDF2 hash.
+        """
+        return hashed_password.startswith(b"$pbkdf2-")
+
+    def hash(self, password: bytes) -> bytes:
+        """Salts and hashes an encoded password with PBKDF2.
+        """
+        salt = os.urandom(16)
+        digest = hashlib.pbkdf2_hmac(self.digest, password, salt,
+                                     self.iterations)
+        return b"$pbkdf2-%s$%d$%s$%s" % (
+            self.digest.encode(), self.iterations, base64.b64encode(salt),
+            base64.b64encode(digest))
+
+    def verify(self, hashed_password: bytes, password: bytes) -> bool:
+        """Checks an encoded password against a PBKDF2 hash.
+        """
+        _, scheme, iterations, salt, digest = hashed_password.split(b"$")
+        digest = base64.b64decode(digest)
+        return hmac.compare_digest(hashlib.pbkdf2_hmac(
+            scheme[len(b"pbkdf2-"):].decode(), password,
+            base64.b64decode(salt), int(iterations)), digest)
+
+    def needs_rehash(self, hashed_password: bytes) -> bool:
+        """Tells whether a PBKDF2 hash used another digest or fewer
+        iterations than the backend.
+        """
+        _, scheme, iterations, _, _ = hashed_password.split(b"$")
+        return scheme != b"pbkdf2-" + self.digest.encode() or \
+            int(iterations) < self.iterations
+
+
+# Password hashing backends by scheme name
+BACKENDS: Dict[str, PasswordBackend] = {}
+# Scheme new hashes are made with
+DEFAULT_SCHEME = os.getenv("PASSWORD_SCHEME", "bcrypt")
+
+
+def register_backend(backend: PasswordBackend) -> None:
+    """Adds a backend to BACKENDS, or replaces the one of the same name,
+    e.g. to change its parameters.
+
+    Args:
+        backend (PasswordBackend): The backend.
+    """
+    BACKENDS[backend.name] = backend
+
+
+for _backend in (BcryptBackend(), ScryptBackend(), PBKDF2Backend()):
+    register_backend(_backend)
+
+
+def identify(hashed_password: bytes) -> Optional[PasswordBackend]:
+    """Finds the backend a stored hash was made with.
+
+    Args:
+        hashed_password (bytes): Hashed password.
+
+    Returns:
+        Optional[PasswordBackend]: The backend, or None if no backend
+        recognizes the hash.
+    """
+    for backend in BACKENDS.values():
+        if backend.identify(hashed_password):
+            return backend
+    return None
+
+
+def hash_password(password: str, scheme: str = None) -> bytes:
+    """Hashes the provided password using bcrypt, or another registered
+    backend.
 
     Use the bcrypt package to perform the hashing (with hashpw).
 
     Args:
         password (str): Password to be hashed.
+        scheme (str): The backend to use, DEFAULT_SCHEME (bcrypt unless the
+        PASSWORD_SCHEME environment variable says otherwise) if None.
 
     Returns:
         bytes: A salted, hashed password in byte string format.
     """
-    # Salt and hash the password using the bcrypt package
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    # Salt and hash the password with the backend of the scheme, bcrypt
+    # uses the work factor calibrated for this machine
+    return BACKENDS[scheme or DEFAULT_SCHEME].hash(password.encode('utf-8'))
 
 
 def is_valid(hashed_password: bytes, password: str) -> bool:
     """Validates that the provided password matches the hashed password.
 
+    The scheme and its parameters are read from the hash, so hashes made
+    by any registered backend, at any cost, are accepted.
+
     Args:
         hashed_password (bytes): Hashed password.
         password (str): Password to be validated.
@@ -35,8 +355,119 @@ def is_valid(hashed_password: bytes, password: str) -> bool:
     """
     # Try to match the hashed password with the given password
     try:
-        return bcrypt.checkpw(password.encode('utf-8'), hashed_password)
+        backend = identify(hashed_password)
+        if backend is None:
+            raise ValueError("Unknown password hash scheme")
+        return backend.verify(hashed_password, password.encode('utf-8'))
     # If there is an exception in the process, log the error message
     except Exception as e:
         logging.error("Error in password validation: {}".format(e))
         return False
+
+
+def needs_rehash(hashed_password: bytes) -> bool:
+    """Tells whether a stored hash should be replaced, because it was made
+    with another scheme than DEFAULT_SCHEME or with weaker parameters.
+
+    Callers can rehash transparently at login: once is_valid accepted the
+    password, store hash_password(password) if this returns True.
+
+    Args:
+        hashed_password (bytes): Hashed password.
+
+    Returns:
+        bool: True if the hash should be upgraded.
+    """
+    backend = identify(hashed_password)
+    if backend is None or backend is not BACKENDS[DEFAULT_SCHEME]:
+        return True
+    try:
+        return backend.needs_rehash(hashed_password)
+    except Exception:
+        return True
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Returns the thread pool the concurrent password functions run on.
+
+    Returns:
+        ThreadPoolExecutor: A pool of PASSWORD_HASH_WORKERS threads (one per
+        core by default), created on first use.
+    """
+    global _executor, _workers
+    with _executor_lock:
+        if _executor is None:
+            _workers = int(os.getenv("PASSWORD_HASH_WORKERS",
+                                     os.cpu_count() or 1))
+            _executor = ThreadPoolExecutor(
+                max_workers=_workers, thread_name_prefix="password")
+        return _executor
+
+
+async def hash_password_async(password: str) -> bytes:
+    """Hashes the provided password on the thread pool, see hash_password.
+
+    Args:
+        password (str): Password to be hashed.
+
+    Returns:
+        bytes: A salted, hashed password in byte string format.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), hash_password, password)
+
+
+async def is_valid_async(hashed_password: bytes, password: str) -> bool:
+    """Validates a password on the thread pool, see is_valid.
+
+    Args:
+        hashed_password (bytes): Hashed password.
+        password (str): Password to be validated.
+
+    Returns:
+        bool: True if the hashed password was formed from the given password,
+        otherwise False.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_executor(), is_valid, hashed_password, password)
+
+
+def _map_bounded(func: Callable, items: Iterable) -> Iterator:
+    """Runs func over the items on the thread pool, in order, with at most
+    two items per thread in flight so large iterables are not read ahead.
+    """
+    executor = get_executor()
+    window = 2 * _workers
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def hash_passwords(passwords: Iterable[str]) -> List[bytes]:
+    """Hashes many passwords in parallel, e.g. for a bulk user import.
+
+    Args:
+        passwords (Iterable[str]): Passwords to be hashed.
+
+    Returns:
+        List[bytes]: The hashed passwords, in the order of `passwords`.
+    """
+    return list(_map_bounded(hash_password, passwords))
+
+
+def verify_many(pairs: Iterable[Tuple[bytes, str]]) -> List[bool]:
+    """Validates many passwords in parallel, see is_valid.
+
+    Args:
+        pairs (Iterable[Tuple[bytes, str]]): (hashed password, password)
+        pairs.
+
+    Returns:
+        List[bool]: Whether each password matches its hash, in order.
+    """
+    return list(_map_bounded(lambda pair: is_valid(*pair), pairs))
@@ -3,11 +3,28 @@
 """
 
 
+import argparse
+import atexit
+import copy
+import csv
 import logging
 import os
 import mysql.connector
+import queue
 import re
-from typing import List
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
+from typing import (
+    Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union,
+)
 
 
 patterns = {
@@ -16,6 +33,414 @@ patterns = {
 }
 # Tuple of PII fields
 PII_FIELDS = ("name", "email", "phone", "ssn", "password")
+# Logging `extra` of messages that are already redacted, see
+# RedactingFormatter.formatMessage
+PRE_REDACTED = {"pre_redacted": True}
+# Schema of the users table for the SQLite backend, as in user_data.csv
+USERS_SCHEMA = """CREATE TABLE IF NOT EXISTS users (
+    name VARCHAR(256),
+    email VARCHAR(256),
+    phone VARCHAR(16),
+    ssn VARCHAR(16),
+    password VARCHAR(256),
+    ip VARCHAR(64),
+    last_login TIMESTAMP,
+    user_agent VARCHAR(512)
+)"""
+
+
+class RedactionMetrics:
+    """Counters and timings of the redaction paths.
+
+    Nothing is measured until `enabled` is set (see `enable_metrics`), so
+    the instrumented functions only pay for one attribute check by default.
+    `snapshot` returns the figures as a dict and `expose` renders them in
+    the Prometheus text format, for a scrape endpoint.
+    """
+
+    # Upper bounds, in seconds, of the timing histogram buckets
+    BUCKETS = (1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 1e-2,
+               float("inf"))
+
+    def __init__(self):
+        """Initializes disabled, empty metrics.
+        """
+        self.enabled = False
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """Sets every counter and timing back to zero.
+        """
+        with self._lock:
+            self._lines = {}
+            self._fields = {}
+            self._timings = {}
+
+    def observe(self, name: str, seconds: float,
+                fields: Dict[str, int] = None) -> None:
+        """Records one line processed by an instrumented function.
+
+        Args:
+            name (str): The function, e.g. "filter_datum".
+            seconds (float): The time it spent on the line.
+            fields (Dict[str, int]): The values it redacted, per field.
+        """
+        with self._lock:
+            self._lines[name] = self._lines.get(name, 0) + 1
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = {
+                    "count": 0, "sum": 0.0, "buckets": [0] * len(self.BUCKETS)}
+            timing["count"] += 1
+            timing["sum"] += seconds
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    timing["buckets"][i] += 1
+                    break
+            self._count_fields(fields or {})
+
+    def count_fields(self, fields: Dict[str, int]) -> None:
+        """Records redacted values, per field.
+
+        Args:
+            fields (Dict[str, int]): The number of values redacted per field.
+        """
+        with self._lock:
+            self._count_fields(fields)
+
+    def _count_fields(self, fields: Dict[str, int]) -> None:
+        """Adds to the per field counters, with the lock held.
+        """
+        for field, count in fields.items():
+            self._fields[field] = self._fields.get(field, 0) + count
+
+    def snapshot(self) -> Dict:
+        """Returns a copy of the current figures.
+
+        Returns:
+            Dict: The lines processed and the cumulative time and histogram
+            (counts per bucket upper bound, not cumulative) per function,
+            and the values redacted per field.
+        """
+        with self._lock:
+            return {
+                "lines": dict(self._lines),
+                "fields": dict(self._fields),
+                "timings": {
+                    name: {"count": timing["count"], "sum": timing["sum"],
+                           "buckets": dict(zip(
+                               [str(bound) for bound in self.BUCKETS],
+                               timing["buckets"]))}
+                    for name, timing in self._timings.items()},
+            }
+
+    def expose(self) -> str:
+        """Renders the figures in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics, one sample per line.
+        """
+        snapshot = self.snapshot()
+        lines = ["# TYPE redaction_lines_total counter"]
+        lines += ['redaction_lines_total{{function="{}"}} {}'.format(
+            name, count) for name, count in snapshot["lines"].items()]
+        lines.append("# TYPE redaction_fields_total counter")
+        lines += ['redaction_fields_total{{field="{}"}} {}'.format(
+            field, count) for field, count in snapshot["fields"].items()]
+        lines.append("# TYPE redaction_seconds histogram")
+        for name, timing in snapshot["timings"].items():
+            cumulative = 0
+            for bound, count in timing["buckets"].items():
+                cumulative += count
+                lines.append(
+                    'redaction_seconds_bucket{{function="{}",le="{}"}} {}'
+                    .format(name, "+Inf" if bound == "inf" else bound,
+                            cumulative))
+            lines.append('redaction_seconds_sum{{function="{}"}} {}'.format(
+                name, timing["sum"]))
+            lines.append('redaction_seconds_count{{function="{}"}} {}'.format(
+                name, timing["count"]))
+        return "\n".join(lines) + "\n"
+
+
+# Metrics of filter_datum, filter_datum_many and RedactingFormatter.format
+METRICS = RedactionMetrics()
+
+
+def enable_metrics(enabled: bool = True) -> RedactionMetrics:
+    """Turns the redaction metrics on or off.
+
+    Args:
+        enabled (bool): Whether to measure the redaction paths.
+
+    Returns:
+        RedactionMetrics: The module's metrics, to snapshot or expose.
+    """
+    METRICS.enabled = enabled
+    return METRICS
+
+
+class Redactor:
+    """Redaction engine for one (fields, separator, redaction) combination.
+
+    The extraction pattern is built and compiled once, when the redactor is
+    created, so redacting a log line only costs the substitution itself.
+    Use `get_redactor` to obtain a shared, cached instance.
+    """
+
+    def __init__(
+            self, fields: Sequence[str], redaction: str, separator: str,
+    ):
+        """Initializes the redactor and compiles its pattern.
+
+        Args:
+            fields (Sequence[str]): The fields to obfuscate.
+            redaction (str): What the field values are replaced with.
+            separator (str): The character(s) separating the fields.
+        """
+        self.fields = tuple(fields)
+        self.redaction = redaction
+        self.separator = separator
+        self.pattern = re.compile(patterns["extract"](self.fields, separator))
+        self.replacement = patterns["replace"](redaction)
+        # Compiled on first use by the bytes API
+        self._bytes_pattern = None
+
+    def redact(self, message: str) -> str:
+        """Returns the message with the values of `self.fields` obfuscated.
+
+        Args:
+            message (str): A string representing the log line.
+
+        Returns:
+            str: The log message obfuscated.
+        """
+        return self.pattern.sub(self.replacement, message)
+
+    def redact_counted(self, message: str) -> Tuple[str, Dict[str, int]]:
+        """Obfuscates the message like `redact` and counts the values
+        replaced per field, for RedactionMetrics.
+
+        Args:
+            message (str): A string representing the log line.
+
+        Returns:
+            Tuple[str, Dict[str, int]]: The log message obfuscated and the
+            number of values replaced for each field found.
+        """
+        counts = {}
+
+        def replace(match: re.Match) -> str:
+            """Counts the field of a match and returns its replacement."""
+            field = match.group("field")
+            counts[field] = counts.get(field, 0) + 1
+            return match.expand(self.replacement)
+
+        return self.pattern.sub(replace, message), counts
+
+    @property
+    def bytes_pattern(self) -> re.Pattern:
+        """The extraction pattern compiled for bytes messages.
+        """
+        if self._bytes_pattern is None:
+            if not self.separator.isascii():
+                raise ValueError("Bytes redaction needs an ASCII separator")
+            self._bytes_pattern = re.compile(
+                patterns["extract"](self.fields, self.separator).encode())
+        return self._bytes_pattern
+
+    def redact_bytes(self, message: bytes) -> bytes:
+        """Returns the message with the values of `self.fields` obfuscated,
+        without decoding it.
+
+        Args:
+            message (bytes): The UTF-8 log line, as bytes, bytearray or
+            memoryview.
+
+        Returns:
+            bytes: The log message obfuscated.
+        """
+        if isinstance(message, bytes):
+            return self.bytes_pattern.sub(
+                self.replacement.encode(), message)
+        return b"".join(self._redacted_chunks(message))
+
+    def redact_into(self, message: bytes, out: bytearray) -> int:
+        """Writes the message with the values of `self.fields` obfuscated to
+        the start of a preallocated buffer.
+
+        Args:
+            message (bytes): The UTF-8 log line, as bytes, bytearray or
+            memoryview.
+            out (bytearray): A writable buffer, e.g. a bytearray or a
+            memoryview of one.
+
+        Returns:
+            int: The number of bytes written.
+        """
+        written = 0
+        with memoryview(out) as buffer, buffer.cast("B") as dst:
+            for chunk in self._redacted_chunks(message):
+                end = written + len(chunk)
+                if end > len(dst):
+                    raise ValueError("Output buffer too small")
+                dst[written:end] = chunk
+                written = end
+        return written
+
+    def _redacted_chunks(self, message: bytes) -> Iterator[bytes]:
+        """Yields the pieces of the redacted message: slices of the original
+        message and the encoded redaction.
+        """
+        redaction = self.redaction.encode()
+        last = 0
+        with memoryview(message) as src:
+            for match in self.bytes_pattern.finditer(src):
+                # Keep everything up to and including "field="
+                yield src[last:match.end("field") + 1]
+                yield redaction
+                last = match.end()
+            yield src[last:]
+
+
+class TokenRedactor(Redactor):
+    """Redaction engine for `key=value<separator>` lines that does not use
+    regular expressions.
+
+    The line is split on the separator characters and every token is checked
+    against a frozenset of the fields, then the line is joined back together.
+    The output is the same as the regex path: like the `[^...]` class of the
+    pattern, every character of the separator ends a value, and a field also
+    matches at the end of a longer key (e.g. `name` in `username=`).
+    Fields, separators or redactions that the pattern would read as regex
+    syntax are handed to the regex path.
+
+    With a multi-character separator, parts holding several `=` signs are
+    scanned one `=` at a time, which is slower than the regex path for
+    lines made of many short `key=value` pairs.
+    """
+
+    def __init__(
+            self, fields: Sequence[str], redaction: str, separator: str,
+    ):
+        """Initializes the redactor and its lookup tables.
+
+        Args:
+            fields (Sequence[str]): The fields to obfuscate.
+            redaction (str): What the field values are replaced with.
+            separator (str): The character(s) separating the fields.
+        """
+        super(TokenRedactor, self).__init__(fields, redaction, separator)
+        self.keys = frozenset(self.fields)
+        # Every character of the separator ends a value, in order of
+        # appearance and without duplicates
+        self.stops = tuple(dict.fromkeys(separator))
+        self.tokenizable = (
+            len(self.fields) > 0 and len(self.stops) > 0
+            and not any(c in "]\\^-=" for c in separator)
+            and "\\" not in redaction
+            and all(f and f == re.escape(f) and "=" not in f
+                    and not any(c in f for c in self.stops)
+                    for f in self.fields)
+        )
+
+    def redact(self, message: str) -> str:
+        """Returns the message with the values of `self.fields` obfuscated.
+
+        Args:
+            message (str): A string representing the log line.
+
+        Returns:
+            str: The log message obfuscated.
+        """
+        if not self.tokenizable:
+            return super(TokenRedactor, self).redact(message)
+        keys, fields, stop = self.keys, self.fields, self.stops[0]
+        others = self.stops[1:]
+        parts = message.split(stop)
+        for i, part in enumerate(parts):
+            eq = part.find("=")
+            if eq < 0:
+                continue
+            if not others and part[:eq] in keys:
+                parts[i] = part[:eq + 1] + self.redaction
+            elif part.find("=", eq + 1) >= 0:
+                parts[i] = self._redact_part(part, eq)
+            elif part.endswith(fields, 0, eq):
+                # A single field, e.g. ` name=A B` with a `; ` separator: its
+                # value ends at the first other separator character
+                end = len(part)
+                for other in others:
+                    found = part.find(other, eq + 1)
+                    if 0 <= found < end:
+                        end = found
+                parts[i] = part[:eq + 1] + self.redaction + part[end:]
+        return stop.join(parts)
+
+    def _redact_part(self, part: str, eq: int) -> str:
+        """Redacts the part of a line between two occurrences of the first
+        separator character, starting at its first `=` sign.
+
+        A field matches when it ends the text in front of an `=` sign, and
+        its value then runs up to the next separator character.
+        """
+        keys, fields, others = self.keys, self.fields, self.stops[1:]
+        chunks, pos = [], 0
+        while eq >= 0:
+            if part[pos:eq] in keys or part.endswith(fields, pos, eq):
+                end = len(part)
+                for stop in others:
+                    found = part.find(stop, eq + 1)
+                    if 0 <= found < end:
+                        end = found
+                chunks.append(part[pos:eq + 1])
+                chunks.append(self.redaction)
+                pos = end
+                eq = part.find("=", end)
+            else:
+                eq = part.find("=", eq + 1)
+        if not chunks:
+            return part
+        chunks.append(part[pos:])
+        return "".join(chunks)
+
+
+# Redaction engines selectable by name, e.g. on RedactingFormatter
+REDACTORS = {
+    "regex": Redactor,
+    "token": TokenRedactor,
+}
+
+
+@lru_cache(maxsize=128)
+def _cached_redactor(
+        fields: Tuple[str, ...], redaction: str, separator: str, mode: str,
+) -> Redactor:
+    """Builds the redactor for a hashable key, see `get_redactor`.
+    """
+    return REDACTORS[mode](fields, redaction, separator)
+
+
+def get_redactor(
+        fields: Sequence[str], redaction: str, separator: str,
+        mode: str = "regex",
+) -> Redactor:
+    """Returns the shared Redactor for the given fields, redaction and
+    separator, compiling it on first use only.
+
+    Args:
+        fields (Sequence[str]): The fields to obfuscate.
+        redaction (str): What the field values are replaced with.
+        separator (str): The character(s) separating the fields.
+        mode (str): The redaction engine, a key of `REDACTORS`.
+
+    Returns:
+        Redactor: A compiled redactor.
+    """
+    if mode not in REDACTORS:
+        raise ValueError("Unknown redaction mode: {}".format(mode))
+    return _cached_redactor(tuple(fields), redaction, separator, mode)
 
 
 class RedactingFormatter(logging.Formatter):
@@ -32,18 +457,29 @@ class RedactingFormatter(logging.Formatter):
     FORMAT = "[HOLBERTON] %(name)s %(levelname)s %(asctime)-15s: %(message)s"
     SEPARATOR = ";"
 
-    def __init__(self, fields: List[str]):
+    def __init__(self, fields: List[str], mode: str = "regex"):
         """Initializes the class.
 
         Args:
             fields (List[str]): The fields.
+            mode (str): The redaction engine, "regex" or "token".
         """
         super(RedactingFormatter, self).__init__(self.FORMAT)
         self.fields = fields
+        self.field_set = frozenset(fields)
+        self.redactor = get_redactor(
+            fields, self.REDACTION, self.SEPARATOR, mode)
+        # (second, datefmt, formatted time) of the last formatted record
+        self._time_cache = (None, None, None)
 
     def format(self, record: logging.LogRecord) -> str:
         """Filters values in incoming log records using filter_datum.
 
+        Only the message (`record.getMessage()`) and tracebacks are redacted,
+        not the prefix of the log line, see `formatMessage`. Records whose
+        `msg` or `args` is a mapping are redacted by key before the message
+        is formatted, see `redact_mapping`.
+
         Args:
             record (logging.LogRecord): A logging.LogRecord instance.
 
@@ -51,12 +487,141 @@ class RedactingFormatter(logging.Formatter):
             str: A string with all occurrences of the `self.fields` in
             `record.message` replaced by the `self.REDACTION` string.
         """
-        # Call the parent class's format method to get the formatted log line
-        msg = super(RedactingFormatter, self).format(record)
-        # Use the filter_datum function to perform substitution of self.fields
-        text = filter_datum(self.fields, self.REDACTION, msg, self.SEPARATOR)
+        if not METRICS.enabled:
+            return self._format(record)
+        start = time.perf_counter()
+        text = self._format(record)
+        METRICS.observe("RedactingFormatter.format",
+                        time.perf_counter() - start)
         return text
 
+    def _format(self, record: logging.LogRecord) -> str:
+        """Formats a record, redacting mappings by key, see `format`.
+        """
+        redacted = self.redact_mapping(record)
+        if redacted is None:
+            return super(RedactingFormatter, self).format(record)
+        return super(RedactingFormatter, self).format(redacted)
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        """Redacts `record.message` and merges it into FORMAT.
+
+        Records whose `pre_redacted` attribute is true, e.g. logged with
+        `extra={"pre_redacted": True}`, already hold a redacted message and
+        are not redacted again.
+
+        Args:
+            record (logging.LogRecord): A record whose message is set.
+
+        Returns:
+            str: The formatted log line, without traceback.
+        """
+        if getattr(record, "pre_redacted", False):
+            pass
+        elif METRICS.enabled:
+            record.message, counts = self.redactor.redact_counted(
+                record.message)
+            METRICS.count_fields(counts)
+        else:
+            record.message = self.redactor.redact(record.message)
+        return super(RedactingFormatter, self).formatMessage(record)
+
+    def formatException(self, ei) -> str:
+        """Formats an exception and redacts its free text.
+        """
+        return self.redactor.redact(
+            super(RedactingFormatter, self).formatException(ei))
+
+    def formatStack(self, stack_info: str) -> str:
+        """Formats stack information and redacts its free text.
+        """
+        return self.redactor.redact(
+            super(RedactingFormatter, self).formatStack(stack_info))
+
+    def formatTime(
+            self, record: logging.LogRecord, datefmt: str = None,
+    ) -> str:
+        """Formats the creation time of a record, reusing the text of the
+        previous record when it was created in the same second.
+
+        Args:
+            record (logging.LogRecord): A logging.LogRecord instance.
+            datefmt (str): A time.strftime format, the default format with
+            milliseconds if None.
+
+        Returns:
+            str: The formatted time.
+        """
+        second = int(record.created)
+        cached_second, cached_datefmt, text = self._time_cache
+        if second != cached_second or datefmt != cached_datefmt:
+            text = time.strftime(datefmt or self.default_time_format,
+                                 self.converter(record.created))
+            # A single assignment, so threads never see a mixed entry
+            self._time_cache = (second, datefmt, text)
+        if datefmt or not self.default_msec_format:
+            return text
+        return self.default_msec_format % (text, record.msecs)
+
+    def redact_mapping(
+            self, record: logging.LogRecord,
+    ) -> Optional[logging.LogRecord]:
+        """Redacts a structured record by key lookup.
+
+        A mapping `msg`, e.g. `logger.info(row)`, becomes a
+        `key=value;` message with the values of `self.fields` replaced, and
+        the values of `self.fields` in mapping `args`, e.g.
+        `logger.info("%(email)s logged in", row)`, are replaced before they
+        are merged into the message. The template and the other values may
+        still hold PII, so that message is redacted by the regex as well.
+
+        Args:
+            record (logging.LogRecord): A logging.LogRecord instance.
+
+        Returns:
+            Optional[logging.LogRecord]: A redacted copy of the record, or
+            None if neither its msg nor its args is a mapping.
+        """
+        fields, redaction = self.field_set, self.REDACTION
+        if isinstance(record.msg, Mapping):
+            msg = "".join([
+                "{}={}{}".format(
+                    key, redaction if key in fields else value,
+                    self.SEPARATOR)
+                for key, value in record.msg.items()])
+            args = None
+        elif isinstance(record.args, Mapping) and record.args:
+            msg = record.msg
+            args = {key: redaction if key in fields else value
+                    for key, value in record.args.items()}
+        else:
+            return None
+        if METRICS.enabled:
+            keys = record.msg if args is None else record.args
+            METRICS.count_fields({key: 1 for key in keys if key in fields})
+        # Other handlers may format the same record, do not modify it
+        redacted = copy.copy(record)
+        redacted.msg, redacted.args = msg, args
+        # Only a message built from a mapping msg is entirely redacted
+        redacted.pre_redacted = args is None
+        return redacted
+
+    def format_batch(
+            self, records: Iterable[logging.LogRecord],
+    ) -> Iterator[str]:
+        """Formats and filters many log records, lazily.
+
+        Args:
+            records (Iterable[logging.LogRecord]): The records to format.
+
+        Yields:
+            str: Each formatted record, with the values of `self.fields`
+            replaced by the `self.REDACTION` string.
+        """
+        fmt = self.format
+        for record in records:
+            yield fmt(record)
+
 
 def filter_datum(
         fields: List[str], redaction: str, message: str, separator: str,
@@ -75,11 +640,159 @@ def filter_datum(
     Returns:
         str: the log message obfuscated.
     """
-    extract, replace = (patterns["extract"], patterns["replace"])
-    return re.sub(extract(fields, separator), replace(redaction), message)
+    redactor = get_redactor(fields, redaction, separator)
+    if not METRICS.enabled:
+        return redactor.redact(message)
+    return _redact_measured(redactor, message)
+
+
+def _redact_measured(redactor: Redactor, message: str) -> str:
+    """Obfuscates a message, recording the time and the fields in METRICS.
+    """
+    start = time.perf_counter()
+    text, counts = redactor.redact_counted(message)
+    METRICS.observe("filter_datum", time.perf_counter() - start, counts)
+    return text
+
+
+def filter_datum_bytes(
+        fields: List[str], redaction: str, message: bytes, separator: str,
+        out: bytearray = None,
+) -> Union[bytes, int]:
+    """Returns the log message with certain fields obfuscated, for messages
+    that are raw UTF-8 bytes, see `filter_datum`.
+
+    Args:
+        fields (List[str]): a list of strings representing all fields to
+        obfuscate.
+        redaction (str): a string representing by what the field will be
+        obfuscated.
+        message (bytes): the log line, as bytes, bytearray or memoryview.
+        separator (str): a string representing by which ASCII character is
+        separating all fields in the log line (message).
+        out (bytearray): a preallocated buffer the obfuscated message is
+        written to, instead of returning new bytes.
+
+    Returns:
+        bytes: the log message obfuscated, or the number of bytes written
+        to `out` when it is given.
+    """
+    redactor = get_redactor(fields, redaction, separator)
+    if out is None:
+        return redactor.redact_bytes(message)
+    return redactor.redact_into(message, out)
+
+
+def filter_datum_many(
+        fields: List[str], redaction: str, messages: Iterable[str],
+        separator: str,
+) -> Iterator[str]:
+    """Obfuscates a stream of log messages, see `filter_datum`.
+
+    The redactor is looked up once for the whole stream and the messages are
+    consumed and yielded one at a time, so any iterable (a file, a generator)
+    can be redacted without holding it in memory.
+
+    Args:
+        fields (List[str]): a list of strings representing all fields to
+        obfuscate.
+        redaction (str): a string representing by what the field will be
+        obfuscated.
+        messages (Iterable[str]): the log lines.
+        separator (str): a string representing by which character is separating
+        all fields in the log lines.
+
+    Returns:
+        Iterator[str]: the log messages obfuscated, produced on demand.
+    """
+    redactor = get_redactor(fields, redaction, separator)
+    if not METRICS.enabled:
+        return map(redactor.redact, messages)
+    return (_redact_measured(redactor, message) for message in messages)
 
 
-def get_logger() -> logging.Logger:
+class BoundedQueueHandler(QueueHandler):
+    """Queue handler that hands records to a background QueueListener
+    through a bounded queue.
+
+    The caller's thread only pays for merging the message arguments and the
+    enqueue; formatting, redaction and I/O happen on the listener thread.
+    When the queue is full, `overflow` decides what happens to the record:
+    "block" waits for room, "drop" discards it and "count" discards it and
+    increments `dropped`.
+    """
+
+    OVERFLOW_POLICIES = ("block", "drop", "count")
+
+    def __init__(self, records: queue.Queue, overflow: str = "block"):
+        """Initializes the handler.
+
+        Args:
+            records (queue.Queue): The bounded queue shared with the listener.
+            overflow (str): The overflow policy, one of OVERFLOW_POLICIES.
+        """
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy: {}".format(overflow))
+        super(BoundedQueueHandler, self).__init__(records)
+        self.overflow = overflow
+        self.dropped = 0
+        self.listener = None
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Prepares a record for the queue.
+
+        QueueHandler.prepare merges `msg` and `args` into a plain message,
+        which would hide a mapping `msg` or `args` from
+        `RedactingFormatter.redact_mapping`: such records are copied with
+        a copy of their mapping instead.
+
+        Args:
+            record (logging.LogRecord): The record to enqueue.
+
+        Returns:
+            logging.LogRecord: The record put on the queue.
+        """
+        if isinstance(record.msg, Mapping):
+            record = copy.copy(record)
+            record.msg = dict(record.msg)
+            return record
+        if isinstance(record.args, Mapping) and record.args:
+            record = copy.copy(record)
+            record.args = dict(record.args)
+            return record
+        return super(BoundedQueueHandler, self).prepare(record)
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """Puts a record on the queue, applying the overflow policy.
+
+        Args:
+            record (logging.LogRecord): The prepared record.
+        """
+        if self.overflow == "block":
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Handler.handle holds the handler lock, so this is thread safe
+            if self.overflow == "count":
+                self.dropped += 1
+
+
+class _DrainingQueueListener(QueueListener):
+    """Queue listener whose stop waits for room in a full bounded queue
+    instead of failing to enqueue its sentinel.
+    """
+
+    def enqueue_sentinel(self) -> None:
+        """Puts the stop sentinel on the queue, blocking if it is full.
+        """
+        self.queue.put(self._sentinel)
+
+
+def get_logger(
+        queued: bool = False, maxsize: int = 10000, overflow: str = "block",
+) -> logging.Logger:
     """Returns a logging.Logger object named "user_data".
 
     The logger should be named "user_data" and only log up to logging.INFO
@@ -92,6 +805,15 @@ def get_logger() -> logging.Logger:
     considered as “important” PIIs or information that you must hide in your
     logs. Use it to parameterize the formatter.
 
+    With `queued`, the StreamHandler runs behind a BoundedQueueHandler on a
+    background listener thread, which is stopped (and drained) at exit.
+
+    Args:
+        queued (bool): Whether to redact and write on a background thread.
+        maxsize (int): The capacity of the queue in queued mode.
+        overflow (str): What to do when the queue is full in queued mode,
+        "block", "drop" or "count".
+
     Returns:
         logging.Logger: A logging.Logger instance.
     """
@@ -103,11 +825,30 @@ def get_logger() -> logging.Logger:
     stream_handler = logging.StreamHandler()
     # Disable propagation of log messages to other loggers
     logger.propagate = False
+    # Drop the handlers of a previous call so repeated jobs do not log
+    # every line more than once
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        if getattr(handler, "listener", None) is not None:
+            # Stopping a listener twice fails, do not stop it at exit too
+            atexit.unregister(handler.listener.stop)
+            handler.listener.stop()
     # Create an instance of the RedactingFormatter class with the PII_FIELDS,
     # as fields and set the formatter of the handler
     stream_handler.setFormatter(RedactingFormatter(PII_FIELDS))
-    # Add the handler to the logger
-    logger.addHandler(stream_handler)
+    if not queued:
+        # Add the handler to the logger
+        logger.addHandler(stream_handler)
+        return logger
+    # Put a bounded queue between the logger and the stream handler, which
+    # is driven by a listener thread
+    queue_handler = BoundedQueueHandler(queue.Queue(maxsize), overflow)
+    listener = _DrainingQueueListener(
+        queue_handler.queue, stream_handler, respect_handler_level=True)
+    queue_handler.listener = listener
+    listener.start()
+    atexit.register(listener.stop)
+    logger.addHandler(queue_handler)
     return logger
 
 
@@ -123,10 +864,17 @@ def get_db() -> mysql.connector.connection.MySQLConnection:
     “localhost”).
     The database name is stored in PERSONAL_DATA_DB_NAME.
 
+    When PERSONAL_DATA_DB_BACKEND is "sqlite", PERSONAL_DATA_DB_NAME is the
+    path of a SQLite file instead (see init_sqlite_db), which lets the same
+    pipeline run without a MySQL server.
+
     Returns:
         mysql.connector.connection.MySQLConnection: Connector to the
         database.
     """
+    if os.getenv("PERSONAL_DATA_DB_BACKEND", "mysql") == "sqlite":
+        db_path = os.getenv("PERSONAL_DATA_DB_NAME") or "user_data.db"
+        return sqlite3.connect(db_path, check_same_thread=False)
     # Get the environment variables for the database credentials
     db_host = os.getenv("PERSONAL_DATA_DB_HOST", "localhost")
     #  OR db_name = os.environ.get('PERSONAL_DATA_DB_USERNAME', 'root')
@@ -144,7 +892,230 @@ def get_db() -> mysql.connector.connection.MySQLConnection:
     return connection
 
 
-def main() -> None:
+def init_sqlite_db(db_path: str, csv_path: str = None) -> None:
+    """Creates the users table in a SQLite file, optionally loading the rows
+    of a CSV export shaped like user_data.csv.
+
+    Args:
+        db_path (str): The path of the SQLite file.
+        csv_path (str): The CSV file to load, if any.
+    """
+    connection = sqlite3.connect(db_path)
+    with connection:
+        connection.execute(USERS_SCHEMA)
+        if csv_path is not None:
+            with open(csv_path, newline="") as f:
+                reader = csv.reader(f)
+                columns = next(reader)
+                connection.executemany(
+                    "INSERT INTO users ({}) VALUES ({})".format(
+                        ", ".join(columns), ", ".join("?" * len(columns))),
+                    reader)
+    connection.close()
+
+
+def is_connected(connection) -> bool:
+    """Checks that a database connection is still usable.
+
+    Args:
+        connection: A MySQL or SQLite connection.
+
+    Returns:
+        bool: True if the server (or file) answers, otherwise False.
+    """
+    try:
+        if isinstance(connection, sqlite3.Connection):
+            connection.execute("SELECT 1").fetchall()
+            return True
+        return connection.is_connected()
+    except Exception:
+        return False
+
+
+class ConnectionPool:
+    """A pool of reusable database connections made by get_db.
+
+    Connections are validated when they are checked out and replaced if
+    the server dropped them, so repeated jobs skip the connect and auth
+    handshake without getting stale connections.
+    """
+
+    def __init__(self, size: int = None, connect: Callable = None):
+        """Initializes the pool, connections are opened on demand.
+
+        Args:
+            size (int): The maximum number of connections, defaults to the
+            PERSONAL_DATA_DB_POOL_SIZE environment variable or 5.
+            connect (Callable): Opens a new connection, defaults to get_db.
+        """
+        if size is None:
+            size = int(os.getenv("PERSONAL_DATA_DB_POOL_SIZE", 5))
+        self.size = size
+        self.connect = connect if connect is not None else get_db
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def acquire(self, timeout: float = None):
+        """Checks a validated connection out of the pool, waiting for one to
+        be released if `size` connections are in use.
+
+        Args:
+            timeout (float): How long to wait for a free slot, forever if
+            None.
+
+        Returns:
+            A database connection.
+        """
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError("No database connection available")
+        try:
+            while True:
+                try:
+                    connection = self._idle.get_nowait()
+                except queue.Empty:
+                    return self.connect()
+                if is_connected(connection):
+                    return connection
+                self._close(connection)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, connection) -> None:
+        """Returns a connection to the pool.
+
+        Args:
+            connection: A connection obtained from `acquire`.
+        """
+        try:
+            connection.rollback()
+            self._idle.put(connection)
+        except Exception:
+            self._close(connection)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self, timeout: float = None):
+        """Checks a connection out for the duration of a `with` block.
+
+        Args:
+            timeout (float): How long to wait for a free slot.
+
+        Yields:
+            A database connection.
+        """
+        connection = self.acquire(timeout)
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self) -> None:
+        """Closes all idle connections.
+        """
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+    @staticmethod
+    def _close(connection) -> None:
+        """Closes a connection, ignoring errors from a dead one.
+        """
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+def fetch_batches(cursor, batch_size: int) -> Iterator[List[tuple]]:
+    """Streams the result set of an executed cursor in batches.
+
+    Args:
+        cursor: A DB-API cursor on which a query was executed.
+        batch_size (int): The number of rows fetched at a time.
+
+    Yields:
+        List[tuple]: The next batch of at most `batch_size` rows.
+    """
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+
+def format_rows(
+        columns: Sequence[str], rows: Iterable[Sequence],
+) -> Iterator[str]:
+    """Turns rows into `field=value` log messages.
+
+    Args:
+        columns (Sequence[str]): The column names, in the order of the rows.
+        rows (Iterable[Sequence]): The rows.
+
+    Yields:
+        str: A message per row, e.g. "name=Bob; email=bob@dylan.com".
+    """
+    for row in rows:
+        yield "; ".join(["{}={}".format(field, value)
+                         for field, value in zip(columns, row)])
+
+
+def redact_rows(columns: Sequence[str], rows: Iterable[Sequence]) -> List[str]:
+    """Formats rows into log messages and obfuscates their PII_FIELDS.
+
+    Args:
+        columns (Sequence[str]): The column names, in the order of the rows.
+        rows (Iterable[Sequence]): The rows.
+
+    Returns:
+        List[str]: The obfuscated messages, in the order of the rows.
+    """
+    return list(filter_datum_many(
+        PII_FIELDS, RedactingFormatter.REDACTION, format_rows(columns, rows),
+        RedactingFormatter.SEPARATOR))
+
+
+def redact_batches(
+        columns: Sequence[str], batches: Iterable[List[tuple]],
+        workers: int = 1,
+) -> Iterator[List[str]]:
+    """Runs redact_rows over batches of rows, on a process pool when more
+    than one worker is requested.
+
+    At most two batches per worker are in flight, so the pool does not read
+    ahead of the consumer, and results come back in the order of the
+    batches.
+
+    Args:
+        columns (Sequence[str]): The column names, in the order of the rows.
+        batches (Iterable[List[tuple]]): The batches of rows.
+        workers (int): The number of worker processes.
+
+    Yields:
+        List[str]: The obfuscated messages of each batch.
+    """
+    if workers <= 1:
+        for rows in batches:
+            yield redact_rows(columns, rows)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for rows in batches:
+            pending.append(executor.submit(redact_rows, columns, rows))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def main(
+        batch_size: int = None, progress: Callable[[int], None] = None,
+        workers: int = 1, db=None,
+) -> None:
     """Obtains a database connection using get_db and retrieve all rows in
     the users table and display each row under a filtered format.
 
@@ -156,25 +1127,63 @@ def main() -> None:
     5. password
 
     Only your main function should run when the module is executed.
+
+    The rows are streamed through fetch, format, redact and log stages
+    `batch_size` rows at a time, so memory does not grow with the table.
+
+    Args:
+        batch_size (int): The number of rows fetched at a time, defaults to
+        the PERSONAL_DATA_BATCH_SIZE environment variable or 1000.
+        progress (Callable[[int], None]): Called with the number of rows
+        logged so far after each batch.
+        workers (int): The number of processes formatting and redacting
+        batches, rows are still logged in their original order.
+        db: A connection to read from, e.g. from a ConnectionPool. It is
+        left open; by default a connection is made with get_db and closed.
     """
+    if batch_size is None:
+        batch_size = int(os.getenv("PERSONAL_DATA_BATCH_SIZE", 1000))
     # Obtain a logger and set the logging level
     logger = get_logger()
     logger.setLevel(logging.INFO)
 
-    # Obtain a database connection
-    db = get_db()
+    # Obtain a database connection, mysql.connector cursors are unbuffered
+    # so rows are read from the server as they are fetched
+    owns_db = db is None
+    if owns_db:
+        db = get_db()
     cursor = db.cursor()
 
-    # Retrieve all rows in the users table
+    # Stream all rows in the users table
     cursor.execute("SELECT * FROM users")
-    rows = cursor.fetchall()
+    columns = [column[0] for column in cursor.description]
 
     # Display each row under a filtered format
-    for row in rows:
-        message = "; ".join([f"{field}={row[field]}" for field in row.keys()])
-        logger.info(filter_datum(PII_FIELDS, RedactingFormatter.REDACTION,
-                                 message, RedactingFormatter.SEPARATOR))
+    count = 0
+    batches = fetch_batches(cursor, batch_size)
+    for messages in redact_batches(columns, batches, workers):
+        for message in messages:
+            # Already redacted by redact_rows
+            logger.info(message, extra=PRE_REDACTED)
+        count += len(messages)
+        if progress is not None:
+            progress(count)
+    cursor.close()
+    if owns_db:
+        db.close()
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(
+        description="Logs the users table with its PII fields filtered.")
+    parser.add_argument("--batch-size", type=int, default=None,
+                        help="rows fetched at a time")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes formatting and redacting rows")
+    parser.add_argument("--progress", action="store_true",
+                        help="report the number of rows logged on stderr")
+    args = parser.parse_args()
+    main(batch_size=args.batch_size, workers=args.workers,
+         progress=(lambda count: print("{} rows".format(count),
+                                       file=sys.stderr))
+         if args.progress else None)
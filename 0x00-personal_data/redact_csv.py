@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Command line tool redacting the PII columns of CSV exports shaped like
+user_data.csv.
+
+The input is memory-mapped and scanned with `mmap.find`, the columns kept
+as they are copied to the output as slices of the mapping, and the output
+is written in chunks, so memory use does not depend on the size of the
+export. Usage:
+
+    ./redact_csv.py user_data.csv -o user_data.redacted.csv
+"""
+
+
+import argparse
+import csv
+import mmap
+import os
+import sys
+from typing import BinaryIO, Sequence
+
+from filtered_logger import PII_FIELDS, RedactingFormatter
+
+
+QUOTE = ord('"')
+NEWLINE = ord("\n")
+
+
+def redact_csv(
+        src_path: str, dst: BinaryIO, fields: Sequence[str] = PII_FIELDS,
+        redaction: str = RedactingFormatter.REDACTION,
+        chunk_size: int = 1 << 20,
+) -> int:
+    """Copies a CSV file with the values of the `fields` columns replaced.
+
+    Quoted values are replaced by a quoted redaction, rows with more or
+    fewer values than the header are copied with the known columns
+    redacted.
+
+    Args:
+        src_path (str): The CSV file to redact, its first line is the header.
+        dst (BinaryIO): Where the redacted CSV is written.
+        fields (Sequence[str]): The columns to redact.
+        redaction (str): What the values are replaced with.
+        chunk_size (int): How many bytes are buffered between writes.
+
+    Returns:
+        int: The number of rows redacted, the header excluded.
+    """
+    with open(src_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                return _redact_mapped(mm, view, size, dst, fields,
+                                      redaction.encode(), chunk_size)
+            finally:
+                view.release()
+
+
+def _redact_mapped(
+        mm: mmap.mmap, view: memoryview, size: int, dst: BinaryIO,
+        fields: Sequence[str], redaction: bytes, chunk_size: int,
+) -> int:
+    """Redacts the rows of a mapped CSV file, see `redact_csv`.
+    """
+    header_end = mm.find(b"\n") + 1 or size
+    names = next(csv.reader([mm[:header_end].decode()]), [])
+    redacted = [name in fields for name in names]
+    quoted = b'"' + redaction + b'"'
+    out = bytearray(view[:header_end])
+    pos, rows = header_end, 0
+    while pos < size:
+        if mm[pos] == NEWLINE or mm[pos:pos + 2] == b"\r\n":
+            # A blank line has no values, copy it as it is
+            end = mm.find(b"\n", pos) + 1
+            out += view[pos:end]
+            pos = end
+            continue
+        # Bytes from `copied` on are not in `out` yet, they are flushed as
+        # one slice when the row ends or a redacted value interrupts them
+        copied, column = pos, 0
+        while True:
+            start = pos
+            if pos == size:
+                # Empty last value of a file ending with a comma
+                end = pos
+            elif mm[pos] == QUOTE:
+                end = mm.find(b'"', pos + 1)
+                # A doubled quote is an escaped quote inside the value
+                while end != -1 and end + 1 < size and mm[end + 1] == QUOTE:
+                    end = mm.find(b'"', end + 2)
+                if end == -1:
+                    raise ValueError(
+                        "Unterminated quoted value at byte {}".format(start))
+                end += 1
+            else:
+                newline = mm.find(b"\n", pos)
+                if newline == -1:
+                    newline = size
+                end = mm.find(b",", pos, newline)
+                if end == -1:
+                    end = newline
+                    if end > pos and mm[end - 1] == ord("\r"):
+                        end -= 1
+            if column < len(redacted) and redacted[column]:
+                out += view[copied:start]
+                out += quoted if start < size and mm[start] == QUOTE \
+                    else redaction
+                copied = end
+            column += 1
+            if end < size and mm[end] == ord(","):
+                pos = end + 1
+                continue
+            pos = mm.find(b"\n", end) + 1 or size
+            break
+        out += view[copied:pos]
+        rows += 1
+        if len(out) >= chunk_size:
+            dst.write(out)
+            out.clear()
+    dst.write(out)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Redacts the PII columns of a CSV export.")
+    parser.add_argument("src", help="CSV file, with a header line")
+    parser.add_argument("-o", "--output", default="-",
+                        help="redacted CSV file, - for stdout")
+    parser.add_argument("--fields", nargs="+", default=list(PII_FIELDS),
+                        help="columns to redact")
+    parser.add_argument("--chunk-size", type=int, default=1 << 20,
+                        help="bytes buffered between writes")
+    args = parser.parse_args()
+    if args.output == "-":
+        redact_csv(args.src, sys.stdout.buffer, args.fields,
+                   chunk_size=args.chunk_size)
+    else:
+        with open(args.output, "wb") as dst:
+            redact_csv(args.src, dst, args.fields,
+                       chunk_size=args.chunk_size)
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""Benchmark suite for the redaction paths of filtered_logger.
+
+Corpora are generated from the columns and value shapes of user_data.csv
+and every scenario (number of redacted fields, how many of them occur in
+the line, line length) is measured for filter_datum,
+RedactingFormatter.format and a get_logger logger end to end. Results are
+written as JSON so runs can be compared across releases, e.g.:
+
+    ./redaction_benchmark.py --lines 1000000 --output bench.json
+"""
+
+
+import argparse
+import csv
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List
+
+import filtered_logger
+
+
+# Fields that never occur in the generated lines
+ABSENT_FIELDS = ("dob", "address", "iban", "passport", "card", "zip", "city",
+                 "country")
+# Line lengths, in characters, the user_agent column is fitted to
+LINE_LENGTHS = {"short": 200, "medium": 400, "long": 1200}
+# Lines per chunk: records are built outside the timed section, per chunk
+CHUNK_SIZE = 10000
+# Lines measured under tracemalloc, which is much slower than the timings
+ALLOC_SAMPLE = 2000
+# The null device the get_logger scenarios write to, opened once for all
+_devnull = None
+
+
+def load_shapes(csv_path: str) -> Dict[str, List[str]]:
+    """Reads the values of every column of a CSV export.
+
+    Args:
+        csv_path (str): A file shaped like user_data.csv.
+
+    Returns:
+        Dict[str, List[str]]: The values seen for each column.
+    """
+    with open(csv_path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    return {column: [row[column] for row in rows] for column in rows[0]}
+
+
+def generate_lines(
+        shapes: Dict[str, List[str]], count: int, length: int,
+        seed: int = 0,
+) -> Iterator[str]:
+    """Generates `key=value;` log lines from the column values, lazily.
+
+    Args:
+        shapes (Dict[str, List[str]]): The values seen for each column.
+        count (int): The number of lines.
+        length (int): The approximate length of a line, reached by cutting
+        or repeating the user_agent value.
+        seed (int): The seed of the random generator.
+
+    Yields:
+        str: A log line.
+    """
+    rng = random.Random(seed)
+    columns = list(shapes)
+    for _ in range(count):
+        values = {column: rng.choice(shapes[column]) for column in columns}
+        line = "".join("{}={};".format(column, values[column])
+                       for column in columns if column != "user_agent")
+        agent = values.get("user_agent", "")
+        room = max(length - len(line) - len("user_agent=;"), 0)
+        agent = (agent * (room // max(len(agent), 1) + 1))[:room]
+        yield "{}user_agent={};".format(line, agent)
+
+
+def chunks(lines: Iterator[str], size: int) -> Iterator[List[str]]:
+    """Groups lines into lists of at most `size` lines.
+    """
+    while True:
+        chunk = list(itertools.islice(lines, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def make_record(line: str) -> logging.LogRecord:
+    """Builds the log record a `logger.info(line)` call would create.
+    """
+    return logging.LogRecord("user_data", logging.INFO, __file__, 0, line,
+                             None, None)
+
+
+def null_logger(fields: List[str]) -> logging.Logger:
+    """Returns the get_logger logger, formatting with `fields` and writing
+    to the null device.
+    """
+    global _devnull
+    if _devnull is None:
+        _devnull = open(os.devnull, "w")
+    logger = filtered_logger.get_logger()
+    handler = logger.handlers[0]
+    handler.setFormatter(filtered_logger.RedactingFormatter(fields))
+    handler.setStream(_devnull)
+    return logger
+
+
+def targets(fields: List[str]) -> Dict[str, Callable]:
+    """Returns the measured functions, each taking a chunk of lines and
+    returning a callable that processes the chunk.
+    """
+    def datum(lines):
+        return lambda: [filtered_logger.filter_datum(
+            fields, "***", line, ";") for line in lines]
+
+    formatter = filtered_logger.RedactingFormatter(fields)
+
+    def fmt(lines):
+        records = [make_record(line) for line in lines]
+        return lambda: [formatter.format(record) for record in records]
+
+    logger = null_logger(fields)
+
+    def end_to_end(lines):
+        return lambda: [logger.info(line) for line in lines]
+
+    return {"filter_datum": datum, "RedactingFormatter.format": fmt,
+            "get_logger": end_to_end}
+
+
+def measure(prepare, lines: Iterator[str]) -> Dict[str, float]:
+    """Times a target over the lines, chunk by chunk.
+
+    Returns:
+        Dict[str, float]: The number of lines, the seconds spent and the
+        throughput.
+    """
+    seconds, count, chars = 0.0, 0, 0
+    for chunk in chunks(lines, CHUNK_SIZE):
+        run = prepare(chunk)
+        start = time.perf_counter()
+        run()
+        seconds += time.perf_counter() - start
+        count += len(chunk)
+        chars += sum(map(len, chunk))
+    return {"lines": count, "seconds": seconds,
+            "lines_per_second": count / seconds if seconds else 0.0,
+            "average_line_length": chars / count if count else 0.0}
+
+
+def measure_allocations(prepare, lines: List[str]) -> Dict[str, float]:
+    """Counts the memory allocated by a target over a sample of lines.
+
+    Returns:
+        Dict[str, float]: The peak traced memory per line, and the blocks
+        and bytes per line still allocated when the target returns (its
+        output included).
+    """
+    # The peak of a fresh trace only counts the target (reset_peak needs
+    # Python 3.9), the snapshots are compared in a second one, each over
+    # newly prepared lines or records
+    run = prepare(lines)
+    tracemalloc.start()
+    output = run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del output
+    run = prepare(lines)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    output = run()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    del output
+    stats = after.compare_to(before, "filename")
+    blocks = sum(stat.count_diff for stat in stats if stat.count_diff > 0)
+    size = sum(stat.size_diff for stat in stats if stat.size_diff > 0)
+    return {"peak_bytes_per_line": peak / len(lines),
+            "blocks_per_line": blocks / len(lines),
+            "bytes_per_line": size / len(lines)}
+
+
+def scenarios(field_counts: List[int]) -> Iterator[Dict]:
+    """Yields every combination of field count, matching fields and line
+    length.
+    """
+    present = list(filtered_logger.PII_FIELDS) + ["ip", "last_login"]
+    for count, length in itertools.product(field_counts, LINE_LENGTHS):
+        for matching in sorted({0, count // 2, min(count, len(present))}):
+            fields = present[:matching] + \
+                list(ABSENT_FIELDS[:count - matching])
+            yield {"fields": fields, "field_count": len(fields),
+                   "matching": matching, "line_length": length}
+
+
+def run(shapes: Dict[str, List[str]], lines: int,
+        field_counts: List[int]) -> Dict:
+    """Runs the whole suite.
+
+    Returns:
+        Dict: The environment and one result per target and scenario.
+    """
+    results = []
+    for scenario in scenarios(field_counts):
+        length = LINE_LENGTHS[scenario["line_length"]]
+        sample = list(generate_lines(shapes, ALLOC_SAMPLE, length, seed=1))
+        for name, prepare in targets(scenario["fields"]).items():
+            result = {"target": name}
+            result.update(scenario)
+            result.update(measure(prepare,
+                                  generate_lines(shapes, lines, length)))
+            result.update(measure_allocations(prepare, sample))
+            results.append(result)
+            print("{target:<26} fields={field_count} matching={matching} "
+                  "{line_length:<6} {lines_per_second:>10.0f} lines/s "
+                  "{blocks_per_line:6.2f} blocks/line".format(**result),
+                  file=sys.stderr)
+    return {"created_at": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "lines": lines,
+            "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the redaction paths of filtered_logger.")
+    parser.add_argument("--csv", default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "user_data.csv"),
+        help="CSV export the value shapes are taken from")
+    parser.add_argument("--lines", type=int, default=100000,
+                        help="lines per scenario and target")
+    parser.add_argument("--fields", type=int, nargs="+", default=[1, 5, 8],
+                        help="numbers of redacted fields to try")
+    parser.add_argument("--output", default="-",
+                        help="JSON results file, - for stdout")
+    args = parser.parse_args()
+    report = run(load_shapes(args.csv), args.lines, args.fields)
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
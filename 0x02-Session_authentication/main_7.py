@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+""" Main 7: lazy loading
+"""
+import os
+import tempfile
+
+os.environ["MODELS_LOADING"] = "lazy"
+os.chdir(tempfile.mkdtemp())
+
+from models.user import User
+
+""" Create users, then load them lazily """
+User.load_from_file()
+for i in range(3):
+    user = User()
+    user.email = "lazy{}@hbtn.io".format(i)
+    user.first_name = "Lazy"
+    user.save()
+
+User.load_from_file()
+print("All users: {}".format(sorted(u.email for u in User.all())))
+print("By email: {}".format([u.email for u in
+                             User.search({'email': "lazy1@hbtn.io"})]))
+print("Not indexed: {}".format(len(User.search({'_password': None}))))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+""" Memory per object report of the models
+
+Loads User and UserSession objects from their serialized form, as
+load_from_file does, once per MODELS_INSTANCES and MODELS_TIMESTAMPS mode
+(each in its own process, the instance layout is chosen when the models
+are imported), and prints the memory they hold per object. Usage:
+
+    ./memory_report.py --objects 100000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tracemalloc
+import uuid
+
+
+MODES = (("dict", "eager"), ("dict", "lazy"),
+         ("slots", "eager"), ("slots", "lazy"))
+
+
+def serialized(model: str, count: int) -> str:
+    """ Return the snapshot text of count objects of model
+    """
+    objs = {}
+    for i in range(count):
+        obj = {
+            'id': str(uuid.UUID(int=i)),
+            'created_at': "2020-01-01T00:00:{:02d}".format(i % 60),
+            'updated_at': "2020-01-02T00:00:{:02d}".format(i % 60),
+        }
+        if model == "User":
+            obj.update({'email': "user{}@example.com".format(i),
+                        '_password': "{:064x}".format(i),
+                        'first_name': "First{}".format(i),
+                        'last_name': "Last{}".format(i)})
+        else:
+            obj.update({'user_id': str(uuid.UUID(int=i + 1)),
+                        'session_id': str(uuid.UUID(int=i + 2))})
+        objs[obj['id']] = obj
+    return json.dumps(objs)
+
+
+def measure(model: str, count: int) -> float:
+    """ Return the bytes held per object of model once loaded
+    """
+    from models.user import User
+    from models.user_session import UserSession
+
+    cls = {"User": User, "UserSession": UserSession}[model]
+    text = serialized(model, count)
+    tracemalloc.start()
+    objs = {obj_id: cls(**obj_json)
+            for obj_id, obj_json in json.loads(text).items()}
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    if len(objs) != count:
+        raise AssertionError("{} objects loaded".format(len(objs)))
+    return size / count
+
+
+def main(count: int):
+    """ Measure every model in every mode, in a process each
+    """
+    print("{:<12} {:<6} {:<6} {:>14}".format(
+        "model", "inst.", "times", "bytes/object"))
+    for model in ("User", "UserSession"):
+        for instances, timestamps in MODES:
+            env = dict(os.environ, MODELS_INSTANCES=instances,
+                       MODELS_TIMESTAMPS=timestamps)
+            size = subprocess.run(
+                [sys.executable, __file__, "--measure", model,
+                 "--objects", str(count)],
+                env=env, check=True, stdout=subprocess.PIPE,
+                universal_newlines=True).stdout
+            print("{:<12} {:<6} {:<6} {:>14.1f}".format(
+                model, instances, timestamps, float(size)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Reports the memory per object of the models.")
+    parser.add_argument("--objects", type=int, default=100000,
+                        help="objects loaded per measure")
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        print(measure(args.measure, args.objects))
+    else:
+        main(args.objects)
@@ -1,37 +1,615 @@
 #!/usr/bin/env python3
 """ Base module
 """
-from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from array import array
+from collections.abc import MutableMapping
+from datetime import datetime, timedelta
+from functools import partial
+from itertools import compress, count
+from types import MemberDescriptorType
+from typing import TypeVar, List, Iterable, Callable
+from os import getenv, path
+import atexit
+import gc
 import json
+import logging
+import operator
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
 import uuid
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+# Storage engine of the models, a name of ENGINES: "json" keeps them in
+# DATA and .db_<Class>.json files, "sqlite" in the SQLITE_PATH database
+STORAGE_ENGINE = getenv("MODELS_ENGINE", "json")
+SQLITE_PATH = getenv("MODELS_SQLITE_PATH", ".db.sqlite3")
+# Timestamps of TIMESTAMP_FORMAT with zero padded fields and a 4 digit
+# year: datetime.fromisoformat reads them and isoformat writes them back
+CANONICAL_TIMESTAMP = re.compile(r"[1-9]\d{3}-\d\d-\d\dT\d\d:\d\d:\d\d",
+                                 re.ASCII)
+# "eager" decodes the timestamps of an object when it is built, "lazy"
+# keeps the loaded text until the attribute is read
+TIMESTAMPS = getenv("MODELS_TIMESTAMPS", "eager")
+# "dict" gives model instances a __dict__, "slots" keeps their attributes
+# in __slots__ instead; read when the model classes are defined
+INSTANCES = getenv("MODELS_INSTANCES", "dict")
+# "objects" keeps a dictionary of model instances per class in DATA,
+# "columns" a ColumnStore holding one column per attribute
+DATA_BACKEND = getenv("MODELS_DATA", "objects")
+EPOCH = datetime(1970, 1, 1)
+SECOND = timedelta(seconds=1)
 DATA = {}
+# "snapshot" rewrites .db_<Class>.json on every save/remove, "journal"
+# appends the change to .db_<Class>.journal instead
+PERSISTENCE = getenv("MODELS_PERSISTENCE", "snapshot")
+# Journal records after which the snapshot is rewritten and the journal
+# emptied
+JOURNAL_COMPACT_THRESHOLD = int(getenv("MODELS_JOURNAL_COMPACT_THRESHOLD",
+                                       1000))
+# Number of records in the journal of each class
+JOURNAL_SIZES = {}
+STORAGE_LOCK = threading.RLock()
+# Seconds between two writes of the changes saved in write-behind mode; 0
+# (default) writes every change through
+WRITE_BEHIND_INTERVAL = float(getenv("MODELS_WRITE_BEHIND_INTERVAL", 0))
+# Pending changes that trigger a write before the interval is over
+WRITE_BEHIND_MAX_PENDING = int(getenv("MODELS_WRITE_BEHIND_MAX_PENDING",
+                                      100))
+# "eager" builds every object on load, "lazy" only reads the ids and the
+# indexes from .db_<Class>.idx.json and builds an object from its offset
+# in the snapshot on first access
+LOADING = getenv("MODELS_LOADING", "eager")
+# Secondary indexes: class name -> attribute -> value -> ids (a dict used
+# as an ordered set), and the indexed values of each object for updates,
+# missing for a class until they are needed after its indexes are loaded
+INDEXES = {}
+INDEXED_VALUES = {}
+# Class name -> id -> rank of the object in DATA, so index candidates are
+# returned in the order of DATA, from a counter shared by every class
+POSITIONS = {}
+SEQUENCE = count()
+# Changes not written yet, per class, and the flusher thread writing them
+PENDING = {}
+PENDING_CONDITION = threading.Condition()
+FLUSHER = None
+# Held while changes taken from PENDING are written, so the flush at exit
+# waits for the one of the flusher thread
+FLUSH_LOCK = threading.Lock()
+LOGGER = logging.getLogger(__name__)
+
+
+def flush():
+    """ Write all pending write-behind changes now, one write per class
+    """
+    with FLUSH_LOCK:
+        with PENDING_CONDITION:
+            pending = dict(PENDING)
+            PENDING.clear()
+        error = None
+        for cls, records in pending.items():
+            try:
+                cls.write_changes(records)
+            except Exception as e:
+                # Keep the changes for the next flush, before the newer ones
+                with PENDING_CONDITION:
+                    PENDING[cls] = records + PENDING.get(cls, [])
+                error = error or e
+        if error is not None:
+            raise error
+
+
+def _flusher():
+    """ Write pending changes every WRITE_BEHIND_INTERVAL seconds, or as
+    soon as WRITE_BEHIND_MAX_PENDING changes are pending
+    """
+    while True:
+        with PENDING_CONDITION:
+            PENDING_CONDITION.wait_for(
+                lambda: sum(map(len, PENDING.values())) >=
+                WRITE_BEHIND_MAX_PENDING, timeout=WRITE_BEHIND_INTERVAL)
+        try:
+            flush()
+        except Exception:
+            LOGGER.exception("Write-behind flush failed, retrying in %s "
+                             "seconds", WRITE_BEHIND_INTERVAL)
+            # Do not retry at once when changes are over the maximum
+            time.sleep(WRITE_BEHIND_INTERVAL)
+
+
+atexit.register(flush)
+
+
+def slots(*names: str) -> tuple:
+    """ Return the __slots__ of a Base subclass declaring its attributes:
+    the names in "slots" mode, none otherwise so instances keep the
+    __dict__ of Base
+    """
+    return names if INSTANCES == "slots" else ()
+
+
+def decode_timestamp(text: str) -> datetime:
+    """ Parse a TIMESTAMP_FORMAT timestamp, as datetime.strptime does
+    """
+    if CANONICAL_TIMESTAMP.fullmatch(text):
+        return datetime.fromisoformat(text)
+    return datetime.strptime(text, TIMESTAMP_FORMAT)
+
+
+def encode_timestamp(value: datetime) -> str:
+    """ Format a datetime with TIMESTAMP_FORMAT, as datetime.strftime does
+    """
+    if value.tzinfo is None and value.year >= 1000:
+        return value.isoformat(timespec='seconds')
+    return value.strftime(TIMESTAMP_FORMAT)
+
+
+class Timestamp():
+    """ Datetime attribute that may hold its canonical TIMESTAMP_FORMAT
+    text, decoded on first read. Kept in the _<name> slot of the class
+    when it has one, in the instance __dict__ otherwise
+    """
+
+    def __set_name__(self, owner, name: str):
+        """ Find the slot of the attribute in its class, if any
+        """
+        self.name = name
+        self.slot = owner.__dict__.get("_{}".format(name))
+
+    def __get__(self, obj, owner=None):
+        """ Return the datetime, decoding and keeping a loaded text once
+        """
+        if obj is None:
+            return self
+        if self.slot is not None:
+            value = self.slot.__get__(obj, owner)
+        else:
+            try:
+                value = obj.__dict__[self.name]
+            except KeyError:
+                raise AttributeError(self.name) from None
+        if type(value) is str:
+            value = decode_timestamp(value)
+            self.__set__(obj, value)
+        return value
+
+    def __set__(self, obj, value):
+        """ Store a datetime, or the text of a loaded timestamp
+        """
+        if self.slot is not None:
+            self.slot.__set__(obj, value)
+        else:
+            obj.__dict__[self.name] = value
+
+    @staticmethod
+    def load(text: str):
+        """ Return the value to store for a loaded timestamp: its text
+        when timestamps are lazy and it encodes back to itself
+        """
+        if type(text) is datetime:
+            return text
+        if TIMESTAMPS == "lazy" and CANONICAL_TIMESTAMP.fullmatch(text):
+            return text
+        return decode_timestamp(text)
+
+
+class Predicate():
+    """ Condition on an attribute in search(), instead of a value the
+    attribute is equal to
+    """
+
+    def matches(self, value) -> bool:
+        """ Return whether an attribute value satisfies the condition
+        """
+        raise NotImplementedError()
+
+    def tests(self, convert: Callable, typed: bool) -> List[Callable]:
+        """ Return the functions a column value must satisfy, all of them:
+        convert turns a search value into a column value, typed tells
+        whether the column is an array (no None in it)
+        """
+        return [self.matches]
+
+
+class In(Predicate):
+    """ The attribute is equal to one of values
+    """
+
+    def __init__(self, values: Iterable):
+        """ Initialize the condition with the accepted values
+        """
+        self.values = list(values)
+
+    def matches(self, value) -> bool:
+        """ Return whether value is one of the values
+        """
+        return value in self.values
+
+    def tests(self, convert: Callable, typed: bool) -> List[Callable]:
+        """ Return a lookup in the set of the converted values
+        """
+        try:
+            return [frozenset(map(convert, self.values)).__contains__]
+        except TypeError:
+            # Unhashable values
+            return [self.matches]
+
+
+class Range(Predicate):
+    """ The attribute is at least low and lower than high, None meaning no
+    bound; datetimes for created_at/updated_at
+    """
+
+    def __init__(self, low=None, high=None):
+        """ Initialize the condition with its bounds
+        """
+        self.low = low
+        self.high = high
+
+    def matches(self, value) -> bool:
+        """ Return whether value is within the bounds
+        """
+        if value is None:
+            return False
+        if self.low is not None and value < self.low:
+            return False
+        return self.high is None or value < self.high
+
+    def tests(self, convert: Callable, typed: bool) -> List[Callable]:
+        """ Return a comparison per bound on an array column
+        """
+        if not typed:
+            return [self.matches]
+        tests = []
+        if self.low is not None:
+            tests.append(partial(operator.le, convert(self.low)))
+        if self.high is not None:
+            tests.append(partial(operator.gt, convert(self.high)))
+        return tests
+
+
+class Prefix(Predicate):
+    """ The attribute is a string starting with prefix
+    """
+
+    def __init__(self, prefix: str):
+        """ Initialize the condition with its prefix
+        """
+        self.prefix = prefix
+
+    def matches(self, value) -> bool:
+        """ Return whether value is a string starting with the prefix
+        """
+        return type(value) is str and value.startswith(self.prefix)
+
+
+class ColumnStore(MutableMapping):
+    """ Objects of a class kept column-wise: one list per attribute, with
+    interned strings, and one array of seconds since EPOCH per timestamp.
+    Objects are built from their row on access, and search() evaluates
+    its conditions one column at a time.
+
+    Removed rows are left empty, and dropped once they are half of them.
+    """
+
+    TIMESTAMP_COLUMNS = ('created_at', 'updated_at')
+
+    def __init__(self, cls):
+        """ Initialize an empty store of cls objects
+        """
+        self.cls = cls
+        # Row -> id, None for a removed row, and id -> row
+        self.ids = []
+        self.rows = {}
+        self.columns = {}
+        self.removed = 0
+
+    def __getitem__(self, obj_id: str) -> TypeVar('Base'):
+        """ Return a new object built from the row of obj_id
+        """
+        # Rows are emptied and renumbered under the lock
+        with STORAGE_LOCK:
+            return self.build(self.rows[obj_id])
+
+    def __setitem__(self, obj_id: str, obj: TypeVar('Base')):
+        """ Add or replace the row of an object
+        """
+        self.load(obj_id, obj.to_json(True))
+
+    def __delitem__(self, obj_id: str):
+        """ Empty the row of an object, compacting when half are empty
+        """
+        with STORAGE_LOCK:
+            row = self.rows.pop(obj_id)
+            self.ids[row] = None
+            for name, column in self.columns.items():
+                column[row] = 0 if name in self.TIMESTAMP_COLUMNS else None
+            self.removed += 1
+            if self.removed * 2 > len(self.ids):
+                self.compact()
+
+    def __iter__(self):
+        """ Iterate over the ids, in the order of the rows
+        """
+        return (obj_id for obj_id in self.ids if obj_id is not None)
+
+    def __len__(self) -> int:
+        """ Return the number of objects
+        """
+        return len(self.rows)
+
+    def __contains__(self, obj_id) -> bool:
+        """ Return whether an object has a row
+        """
+        return obj_id in self.rows
+
+    def load(self, obj_id: str, obj_json: dict):
+        """ Add or replace the row of an object from its JSON dictionary
+        """
+        with STORAGE_LOCK:
+            row = self.rows.get(obj_id)
+            if row is None:
+                row = self.rows[obj_id] = len(self.ids)
+                self.ids.append(obj_id)
+                for name, column in self.columns.items():
+                    column.append(
+                        0 if name in self.TIMESTAMP_COLUMNS else None)
+            for name, value in obj_json.items():
+                column = self.columns.get(name)
+                if column is None:
+                    column = self.columns[name] = self.new_column(name)
+                column[row] = self.encode(name, value)
+
+    def new_column(self, name: str):
+        """ Return an empty column for the rows stored so far
+        """
+        if name in self.TIMESTAMP_COLUMNS:
+            return array('q', bytes(8 * len(self.ids)))
+        return [None] * len(self.ids)
+
+    def encode(self, name: str, value):
+        """ Return the column value of an attribute value
+        """
+        if name in self.TIMESTAMP_COLUMNS:
+            if type(value) is str:
+                value = decode_timestamp(value)
+            return (value - EPOCH) // SECOND
+        if type(value) is str:
+            return sys.intern(value)
+        return value
+
+    def decode(self, name: str, value):
+        """ Return the attribute value of a column value
+        """
+        if name in self.TIMESTAMP_COLUMNS:
+            return EPOCH + timedelta(seconds=value)
+        return value
+
+    def build(self, row: int) -> TypeVar('Base'):
+        """ Build the object of a row
+        """
+        return self.cls(**{name: self.decode(name, column[row])
+                           for name, column in self.columns.items()})
+
+    def raw_json(self, obj_id: str) -> dict:
+        """ Return the JSON dictionary of an object
+        """
+        obj_json = {}
+        with STORAGE_LOCK:
+            row = self.rows[obj_id]
+            for name, column in self.columns.items():
+                value = self.decode(name, column[row])
+                if type(value) is datetime:
+                    value = encode_timestamp(value)
+                obj_json[name] = value
+        return obj_json
+
+    def raw_text(self, obj_id: str) -> str:
+        """ Return the JSON of an object
+        """
+        return json.dumps(self.raw_json(obj_id))
+
+    def peek(self, obj_id: str, attr: str):
+        """ Return an attribute of an object without building it
+        """
+        with STORAGE_LOCK:
+            column = self.columns.get(attr)
+            if column is None:
+                return getattr(self[obj_id], attr, None)
+            return self.decode(attr, column[self.rows[obj_id]])
+
+    def select(self, attributes: dict, ids: List[str] = None) -> list:
+        """ Return the objects matching attributes, among ids when given:
+        every condition on a column is evaluated over the column, from
+        the rows left by the previous one, and the others on the objects
+        """
+        with STORAGE_LOCK:
+            if ids is None:
+                rows = None
+            else:
+                # In the order of the rows rather than of the index
+                rows = sorted(self.rows[i] for i in ids if i in self.rows)
+            others = {}
+            for name, value in attributes.items():
+                column = self.columns.get(name)
+                if column is None:
+                    others[name] = value
+                    continue
+                for test in self.tests(name, value, column):
+                    if rows is None:
+                        rows = list(compress(range(len(column)),
+                                             map(test, column)))
+                    else:
+                        rows = list(compress(
+                            rows, map(test, map(column.__getitem__, rows))))
+            if rows is None:
+                rows = list(compress(range(len(self.ids)), self.ids))
+            elif self.removed:
+                rows = [row for row in rows if self.ids[row] is not None]
+            objs = [self.build(row) for row in rows]
+        if others:
+            objs = [obj for obj in objs if obj.matches(others)]
+        return objs
+
+    def tests(self, name: str, value, column) -> List[Callable]:
+        """ Return the functions the values of a column must satisfy for
+        a search value
+        """
+        def convert(value):
+            try:
+                return self.encode(name, value)
+            except (TypeError, ValueError):
+                # Not a timestamp, equal to no timestamp
+                return object()
+
+        if isinstance(value, Predicate):
+            return value.tests(convert, type(column) is array)
+        return [partial(operator.eq, convert(value))]
+
+    def compact(self):
+        """ Drop the removed rows
+        """
+        rows = list(compress(range(len(self.ids)), self.ids))
+        for name, column in self.columns.items():
+            values = [column[row] for row in rows]
+            self.columns[name] = array('q', values) \
+                if type(column) is array else values
+        self.ids = [self.ids[row] for row in rows]
+        self.rows = {obj_id: row for row, obj_id in enumerate(self.ids)}
+        self.removed = 0
+
+    def close(self):
+        """ Nothing to release
+        """
+
+
+class LazyObjects(MutableMapping):
+    """ Objects of a class loaded on first access
+
+    Until it is built, an object is the offset and length of its JSON in
+    the snapshot, or its JSON dictionary when it comes from the journal.
+    """
+
+    def __init__(self, cls, snapshot=None):
+        """ Initialize an empty mapping reading from the snapshot file
+        """
+        self.cls = cls
+        self.snapshot = snapshot
+        self.entries = {}
+
+    def __getitem__(self, obj_id: str) -> TypeVar('Base'):
+        """ Return an object, built on first access
+        """
+        entry = self.entries[obj_id]
+        if isinstance(entry, Base):
+            return entry
+        with STORAGE_LOCK:
+            entry = self.entries[obj_id]
+            if not isinstance(entry, Base):
+                entry = self.cls(**self.raw_json(obj_id))
+                self.entries[obj_id] = entry
+        return entry
+
+    def __setitem__(self, obj_id: str, obj: TypeVar('Base')):
+        """ Add or replace a built object
+        """
+        self.entries[obj_id] = obj
+
+    def __delitem__(self, obj_id: str):
+        """ Remove an object, built or not
+        """
+        del self.entries[obj_id]
+
+    def __iter__(self):
+        """ Iterate over the ids, without building the objects
+        """
+        return iter(self.entries)
+
+    def __len__(self) -> int:
+        """ Return the number of objects, built or not
+        """
+        return len(self.entries)
+
+    def __contains__(self, obj_id) -> bool:
+        """ Return whether an object is known, built or not
+        """
+        return obj_id in self.entries
+
+    def load(self, obj_id: str, entry):
+        """ Add an object not built yet: its (offset, length) in the
+        snapshot or its JSON dictionary
+        """
+        self.entries[obj_id] = entry
+
+    def raw_text(self, obj_id: str) -> str:
+        """ Return the JSON of an object not built yet, None otherwise
+        """
+        entry = self.entries[obj_id]
+        if isinstance(entry, Base):
+            return None
+        if isinstance(entry, dict):
+            return json.dumps(entry)
+        offset, length = entry
+        with STORAGE_LOCK:
+            self.snapshot.seek(offset)
+            return self.snapshot.read(length).decode()
+
+    def raw_json(self, obj_id: str) -> dict:
+        """ Return the JSON dictionary of an object not built yet
+        """
+        entry = self.entries[obj_id]
+        if isinstance(entry, dict):
+            return entry
+        return json.loads(self.raw_text(obj_id))
+
+    def peek(self, obj_id: str, attr: str):
+        """ Return an attribute of an object without building it
+        """
+        entry = self.entries[obj_id]
+        if isinstance(entry, Base):
+            return getattr(entry, attr, None)
+        return self.raw_json(obj_id).get(attr)
+
+    def close(self):
+        """ Close the snapshot file
+        """
+        if self.snapshot is not None:
+            self.snapshot.close()
 
 
 class Base():
     """ Base class
+
+    Subclasses list the attributes searched by equality in __indexes__;
+    their index is maintained on save, remove and load, so searches on
+    them do not scan every object.
     """
 
+    __indexes__ = ()
+    if INSTANCES == "slots":
+        __slots__ = ('id', '_created_at', '_updated_at')
+    created_at = Timestamp()
+    updated_at = Timestamp()
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
         s_class = str(self.__class__.__name__)
         if DATA.get(s_class) is None:
-            DATA[s_class] = {}
+            DATA[s_class] = self.__class__.new_objects()
 
-        self.id = kwargs.get('id', str(uuid.uuid4()))
+        # Only generate an id when none is loaded
+        self.id = kwargs['id'] if 'id' in kwargs else str(uuid.uuid4())
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = Timestamp.load(kwargs.get('created_at'))
         else:
             self.created_at = datetime.utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = Timestamp.load(kwargs.get('updated_at'))
         else:
             self.updated_at = datetime.utcnow()
 
@@ -48,65 +626,403 @@ class Base():
         """ Convert the object a JSON dictionary
         """
         result = {}
-        for key, value in self.__dict__.items():
+        for key, value in self.fields():
             if not for_serialization and key[0] == '_':
                 continue
             if type(value) is datetime:
-                result[key] = value.strftime(TIMESTAMP_FORMAT)
+                # Timestamps not read yet are still their text
+                result[key] = encode_timestamp(value)
             else:
                 result[key] = value
         return result
 
+    def fields(self) -> Iterable[tuple]:
+        """ Yield the name and stored value of every attribute set, in the
+        order of the __slots__ of the class and then of the __dict__
+        """
+        for key, slot in self.__class__.slot_fields():
+            try:
+                yield key, slot.__get__(self)
+            except AttributeError:
+                continue
+        yield from getattr(self, '__dict__', {}).items()
+
+    @classmethod
+    def slot_fields(cls) -> List[tuple]:
+        """ Return the attribute name and slot of every __slots__ entry of
+        the class and its bases, base classes first
+        """
+        fields = cls.__dict__.get('_slot_fields')
+        if fields is None:
+            fields = []
+            for klass in reversed(cls.__mro__):
+                for name in klass.__dict__.get('__slots__', ()):
+                    key = name
+                    # Timestamp slots are named after their attribute
+                    if isinstance(getattr(cls, name[1:], None), Timestamp):
+                        key = name[1:]
+                    fields.append((key, klass.__dict__[name]))
+            cls._slot_fields = fields
+        return fields
+
+    def matches(self, attributes: dict) -> bool:
+        """ Return whether the object has the attributes, or satisfies
+        their Predicate
+        """
+        for k, v in attributes.items():
+            if isinstance(v, Predicate):
+                if not v.matches(getattr(self, k)):
+                    return False
+            elif (getattr(self, k) != v):
+                return False
+        return True
+
+    @classmethod
+    def new_objects(cls) -> MutableMapping:
+        """ Return the empty container of the objects of the class in DATA
+        """
+        if DATA_BACKEND == "columns":
+            return ColumnStore(cls)
+        return {}
+
     @classmethod
     def load_from_file(cls):
-        """ Load all objects from file
+        """ Load all objects from the storage engine
+        """
+        get_engine().load(cls)
+
+    @classmethod
+    def load_lazily(cls) -> bool:
+        """ Load the ids of the snapshot, with their offset, and the
+        indexes of the class from the offsets index; fall back to the JSON
+        dictionaries of the snapshot when the index is missing, older than
+        it or made for other __indexes__.
+        Returns whether the offsets index was used
         """
         s_class = cls.__name__
         file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
+        idx_path = ".db_{}.idx.json".format(s_class)
         if not path.exists(file_path):
+            DATA[s_class] = LazyObjects(cls)
+            cls.load_indexes({attr: [] for attr in cls.__indexes__}, [])
+            return True
+        snapshot = open(file_path, 'rb')
+        objs = DATA[s_class] = LazyObjects(cls, snapshot)
+        stat = os.fstat(snapshot.fileno())
+        idx = None
+        if path.exists(idx_path):
+            with open(idx_path, 'r') as f:
+                try:
+                    idx = json.load(f)
+                except ValueError:
+                    idx = None
+        if idx is not None and idx.get('size') == stat.st_size \
+                and idx.get('mtime_ns') == stat.st_mtime_ns \
+                and 'indexes' in idx \
+                and set(idx['indexes']) == set(cls.__indexes__):
+            ids, offsets = idx['ids'], idx['offsets']
+            objs.entries.update(zip(ids, zip(offsets[::2], offsets[1::2])))
+            cls.load_indexes(idx['indexes'], ids)
+            return True
+        for obj_id, obj_json in json.load(snapshot).items():
+            objs.load(obj_id, obj_json)
+        return False
+
+    @classmethod
+    def replay_journal(cls, reindex: bool = False):
+        """ Apply the records of the journal to the loaded objects, and to
+        their indexes when reindex is set
+        """
+        s_class = cls.__name__
+        journal_path = ".db_{}.journal".format(s_class)
+        if not path.exists(journal_path):
             return
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+        torn = False
+        with open(journal_path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn last record of an interrupted append
+                    torn = True
+                    continue
+                if record['op'] == 'save' and \
+                        isinstance(DATA[s_class], (LazyObjects, ColumnStore)):
+                    DATA[s_class].load(record['id'], record['obj'])
+                elif record['op'] == 'save':
+                    DATA[s_class][record['id']] = cls(**record['obj'])
+                else:
+                    DATA[s_class].pop(record['id'], None)
+                if reindex and record['op'] == 'save':
+                    cls.index_values(record['id'], record['obj'])
+                elif reindex:
+                    cls.unindex_object(record['id'])
+                JOURNAL_SIZES[s_class] += 1
+        if torn:
+            # Do not append new records after the torn one
+            cls.save_to_file()
 
     @classmethod
     def save_to_file(cls):
-        """ Save all objects to file
+        """ Save all objects to file, and empty the journal they include
         """
         s_class = cls.__name__
         file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        journal_path = ".db_{}.journal".format(s_class)
+        with STORAGE_LOCK:
+            objs = DATA[s_class]
+            lazy = isinstance(objs, (LazyObjects, ColumnStore))
+            # Serialize first, the flusher thread may run next to request
+            # threads. Objects not built yet are copied as they are, and
+            # the offset of each object is kept for the offsets index
+            parts = []
+            offsets = {}
+            pos = 1
+            for obj_id in list(objs):
+                try:
+                    text = objs.raw_text(obj_id) if lazy else None
+                    if text is None:
+                        text = json.dumps(objs[obj_id].to_json(True))
+                except KeyError:
+                    # Removed by a request thread since the ids were copied
+                    continue
+                key = "{}: ".format(json.dumps(obj_id))
+                pos += len(key) + (2 if parts else 0)
+                offsets[obj_id] = (pos, len(text))
+                pos += len(text)
+                parts.append(key + text)
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+            # Write aside and rename, so a crash never leaves half a file.
+            # The output is the one of json.dump, ASCII only, so character
+            # offsets are byte offsets
+            tmp_path = "{}.tmp".format(file_path)
+            with open(tmp_path, 'w') as f:
+                f.write("{" + ", ".join(parts) + "}")
+            os.replace(tmp_path, file_path)
+            if path.exists(journal_path):
+                os.remove(journal_path)
+            JOURNAL_SIZES[s_class] = 0
+            if LOADING == "lazy":
+                cls.save_offsets(offsets)
+
+    @classmethod
+    def save_offsets(cls, offsets: dict):
+        """ Write the offsets index of the snapshot: the ids, the offset and
+        length of every object, the [value, rows] pairs of every index
+        (rows are positions in the ids), and the size and modification
+        time of the snapshot it matches
+        """
+        s_class = cls.__name__
+        file_path = ".db_{}.json".format(s_class)
+        idx_path = ".db_{}.idx.json".format(s_class)
+        stat = os.stat(file_path)
+        ids = list(offsets)
+        rows = {obj_id: row for row, obj_id in enumerate(ids)}
+        idx = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'ids': ids,
+            'offsets': [n for pair in offsets.values() for n in pair],
+            'indexes': {
+                attr: [[value, [rows[i] for i in index_ids if i in rows]]
+                       for value, index_ids in index.items()]
+                for attr, index in INDEXES.get(s_class, {}).items()
+            },
+        }
+        tmp_path = "{}.tmp".format(idx_path)
+        with open(tmp_path, 'w') as f:
+            json.dump(idx, f)
+        os.replace(tmp_path, idx_path)
+
+    @classmethod
+    def append_to_journal(cls, records: List[dict]):
+        """ Append save/remove records to the journal in one write, and
+        compact it once it reaches JOURNAL_COMPACT_THRESHOLD records
+        """
+        s_class = cls.__name__
+        journal_path = ".db_{}.journal".format(s_class)
+        with STORAGE_LOCK:
+            with open(journal_path, 'a') as f:
+                f.write("".join(json.dumps(record) + "\n"
+                                for record in records))
+            JOURNAL_SIZES[s_class] = \
+                JOURNAL_SIZES.get(s_class, 0) + len(records)
+            if JOURNAL_SIZES[s_class] >= JOURNAL_COMPACT_THRESHOLD:
+                cls.save_to_file()
+
+    @classmethod
+    def compact(cls):
+        """ Rewrite the snapshot from memory and empty the journal
+        """
+        cls.save_to_file()
+
+    @classmethod
+    def write_changes(cls, records: List[dict]):
+        """ Persist save/remove records: append them to the journal, or
+        rewrite the snapshot once for all of them
+        """
+        if PERSISTENCE == "journal":
+            cls.append_to_journal(records)
+        else:
+            cls.save_to_file()
+
+    @classmethod
+    def persist(cls, record: dict):
+        """ Persist a save/remove record now, or queue it for the flusher
+        in write-behind mode
+        """
+        global FLUSHER
+        if WRITE_BEHIND_INTERVAL <= 0:
+            cls.write_changes([record])
+            return
+        with PENDING_CONDITION:
+            PENDING.setdefault(cls, []).append(record)
+            if FLUSHER is None:
+                FLUSHER = threading.Thread(target=_flusher, daemon=True)
+                FLUSHER.start()
+            PENDING_CONDITION.notify()
 
     def save(self):
         """ Save current object
         """
-        s_class = self.__class__.__name__
         self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        get_engine().save(self)
 
     def remove(self):
         """ Remove object
         """
-        s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        get_engine().remove(self)
+
+    @classmethod
+    def rebuild_indexes(cls):
+        """ Index every loaded object on the __indexes__ attributes
+        """
+        s_class = cls.__name__
+        with STORAGE_LOCK:
+            indexes = INDEXES[s_class] = {
+                attr: {} for attr in cls.__indexes__}
+            indexed = INDEXED_VALUES[s_class] = {}
+            positions = POSITIONS[s_class] = {}
+            if not indexes:
+                return
+            objs = DATA.get(s_class, {})
+            if isinstance(objs, (LazyObjects, ColumnStore)):
+                # Objects not built yet are indexed without building them
+                peek = objs.peek
+            else:
+                def peek(obj_id, attr):
+                    return getattr(objs[obj_id], attr, None)
+            for obj_id in list(objs):
+                positions[obj_id] = next(SEQUENCE)
+                values = indexed[obj_id] = {}
+                for attr, index in indexes.items():
+                    value = cls._index_key(peek(obj_id, attr))
+                    index.setdefault(value, {})[obj_id] = None
+                    values[attr] = value
+
+    @classmethod
+    def load_indexes(cls, indexes: dict, ids: List[str]):
+        """ Set the indexes of the class from the [value, rows] pairs of
+        every attribute, rows being positions in ids, as save_offsets
+        writes them
+        """
+        s_class = cls.__name__
+        with STORAGE_LOCK:
+            INDEXES[s_class] = {
+                attr: {value: dict.fromkeys(map(ids.__getitem__, rows))
+                       for value, rows in pairs}
+                for attr, pairs in indexes.items()}
+            # Derived from the indexes when an object first changes
+            INDEXED_VALUES.pop(s_class, None)
+            POSITIONS[s_class] = dict(zip(DATA[s_class], SEQUENCE))
+
+    @classmethod
+    def indexed_values(cls) -> dict:
+        """ Return the indexed values of every object of the class, id ->
+        attribute -> value, derived from the indexes after load_indexes
+        """
+        s_class = cls.__name__
+        with STORAGE_LOCK:
+            indexed = INDEXED_VALUES.get(s_class)
+            if indexed is None:
+                indexed = INDEXED_VALUES[s_class] = {}
+                for attr, index in INDEXES.get(s_class, {}).items():
+                    for value, ids in index.items():
+                        for obj_id in ids:
+                            indexed.setdefault(obj_id, {})[attr] = value
+            return indexed
+
+    @classmethod
+    def index_object(cls, obj: TypeVar('Base')):
+        """ Add or move an object in the indexes of its class
+        """
+        cls.index_values(obj.id, {attr: getattr(obj, attr, None)
+                                  for attr in cls.__indexes__})
+
+    @classmethod
+    def index_values(cls, obj_id: str, new_values: dict):
+        """ Add or move an object in the indexes of its class, given the
+        values of its indexed attributes
+        """
+        if not cls.__indexes__:
+            return
+        s_class = cls.__name__
+        with STORAGE_LOCK:
+            indexes = INDEXES.setdefault(
+                s_class, {attr: {} for attr in cls.__indexes__})
+            indexed = cls.indexed_values()
+            if obj_id not in indexed:
+                # A new object, last in DATA
+                POSITIONS.setdefault(s_class, {})[obj_id] = next(SEQUENCE)
+            values = indexed.setdefault(obj_id, {})
+            for attr in cls.__indexes__:
+                value = cls._index_key(new_values.get(attr))
+                if attr in values:
+                    if values[attr] == value:
+                        continue
+                    cls._unindex_value(indexes[attr], values[attr], obj_id)
+                indexes[attr].setdefault(value, {})[obj_id] = None
+                values[attr] = value
+
+    @classmethod
+    def unindex_object(cls, obj_id: str):
+        """ Remove an object from the indexes of its class
+        """
+        s_class = cls.__name__
+        with STORAGE_LOCK:
+            values = cls.indexed_values().pop(obj_id, {})
+            POSITIONS.get(s_class, {}).pop(obj_id, None)
+            for attr, value in values.items():
+                cls._unindex_value(INDEXES[s_class][attr], value, obj_id)
+
+    @staticmethod
+    def _index_key(value):
+        """ Return the key of a value in an index
+        """
+        try:
+            hash(value)
+        except TypeError:
+            # Unhashable values are never equal to an indexed (hashable)
+            # search value, leave them out
+            return None
+        return value
+
+    @staticmethod
+    def _unindex_value(index: dict, value, obj_id: str):
+        """ Remove an id from the entry of a value in an index
+        """
+        ids = index.get(value)
+        if ids is not None:
+            ids.pop(obj_id, None)
+            if not ids:
+                del index[value]
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
-        s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        return get_engine().count(cls)
 
     @classmethod
     def all(cls) -> Iterable[TypeVar('Base')]:
@@ -118,20 +1034,412 @@ class Base():
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
-        s_class = cls.__name__
-        return DATA[s_class].get(id)
+        return get_engine().get(cls, id)
 
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
+        """ Search all objects with matching attributes
+        """
+        return get_engine().search(cls, attributes)
+
+    @classmethod
+    def explain(cls, attributes: dict = {}) -> dict:
+        """ Describe how search() would find the objects matching attributes
+        """
+        return get_engine().explain(cls, attributes)
+
+    @classmethod
+    def _plan(cls, attributes: dict) -> tuple:
+        """ Plan a search: look up every indexed attribute, intersect the
+            ids from the smallest set and leave the other attributes to a
+            scan of the candidates. Returns the plan and the candidate ids,
+            None when every object has to be scanned
+        """
+        indexes = INDEXES.get(cls.__name__, {})
+        lookups = []
+        for k, v in attributes.items():
+            if k not in indexes:
+                continue
+            if isinstance(v, In):
+                # Union of the ids of every value
+                ids = {}
+                for value in v.values:
+                    try:
+                        ids.update(indexes[k].get(value, {}))
+                    except TypeError:
+                        continue
+                lookups.append((k, ids))
+                continue
+            if isinstance(v, Predicate):
+                continue
+            try:
+                lookups.append((k, indexes[k].get(v, {})))
+            except TypeError:
+                # Unhashable search value
+                continue
+        lookups.sort(key=lambda lookup: len(lookup[1]))
+        used = [k for k, ids in lookups]
+        plan = {
+            'strategy': 'index' if lookups else 'full_scan',
+            'indexes': used,
+            'selectivity': {k: len(ids) for k, ids in lookups},
+            'scan': [k for k in attributes if k not in used],
+        }
+        if not lookups:
+            plan['candidates'] = len(DATA.get(cls.__name__, {}))
+            return plan, None
+        ids = list(lookups[0][1])
+        for k, other in lookups[1:]:
+            if not ids:
+                break
+            ids = [i for i in ids if i in other]
+        plan['candidates'] = len(ids)
+        return plan, ids
+
+
+class JSONFileEngine():
+    """ Storage engine keeping the objects of every class in DATA, and
+    persisting them to .db_<Class>.json files
+    """
+
+    def load(self, cls):
+        """ Load all objects from file, then replay the journal
+        """
+        s_class = cls.__name__
+        file_path = ".db_{}.json".format(s_class)
+        if isinstance(DATA.get(s_class), (LazyObjects, ColumnStore)):
+            DATA[s_class].close()
+        DATA[s_class] = cls.new_objects()
+        JOURNAL_SIZES[s_class] = 0
+        INDEXED_VALUES[s_class] = {}
+        POSITIONS[s_class] = {}
+        # Columns are loaded without building objects already
+        lazy = LOADING == "lazy" and DATA_BACKEND != "columns"
+        indexed = False
+        if lazy:
+            # Loading only makes acyclic containers, do not let their
+            # number trigger garbage collections
+            collect = gc.isenabled()
+            gc.disable()
+            try:
+                indexed = cls.load_lazily()
+            finally:
+                if collect:
+                    gc.enable()
+        elif path.exists(file_path):
+            with open(file_path, 'r') as f:
+                objs_json = json.load(f)
+                objs = DATA[s_class]
+                for obj_id, obj_json in objs_json.items():
+                    if isinstance(objs, ColumnStore):
+                        objs.load(obj_id, obj_json)
+                    else:
+                        objs[obj_id] = cls(**obj_json)
+        # Indexes read from the offsets index are updated record by record
+        cls.replay_journal(reindex=indexed)
+        if not indexed:
+            cls.rebuild_indexes()
+        if lazy and not indexed and len(DATA[s_class]) > 0:
+            # Write the offsets index once, for the next start
+            cls.save_to_file()
+
+    def save(self, obj: Base):
+        """ Store an object and persist the change
+        """
+        cls = obj.__class__
+        # The snapshot and its offsets index see both changes or none
+        with STORAGE_LOCK:
+            DATA[cls.__name__][obj.id] = obj
+            cls.index_object(obj)
+        record = {'op': 'save', 'id': obj.id}
+        if PERSISTENCE == "journal":
+            record['obj'] = obj.to_json(True)
+        cls.persist(record)
+
+    def remove(self, obj: Base):
+        """ Remove an object and persist the change
+        """
+        cls = obj.__class__
+        if obj.id in DATA[cls.__name__]:
+            with STORAGE_LOCK:
+                DATA[cls.__name__].pop(obj.id, None)
+                cls.unindex_object(obj.id)
+            cls.persist({'op': 'remove', 'id': obj.id})
+
+    def count(self, cls) -> int:
+        """ Count all objects
+        """
+        return len(DATA[cls.__name__].keys())
+
+    def get(self, cls, id: str) -> Base:
+        """ Return one object by ID
+        """
+        return DATA[cls.__name__].get(id)
+
+    def search(self, cls, attributes: dict) -> List[Base]:
         """ Search all objects with matching attributes
         """
         s_class = cls.__name__
+        objs = DATA[s_class]
+
         def _search(obj):
             if len(attributes) == 0:
                 return True
-            for k, v in attributes.items():
-                if (getattr(obj, k) != v):
-                    return False
+            return obj.matches(attributes)
+
+        ids = cls._plan(attributes)[1]
+        if isinstance(objs, ColumnStore):
+            return objs.select(attributes, ids)
+        if ids is None:
+            return list(filter(_search, objs.values()))
+        if len(ids) > 1:
+            # Indexes keep the ids in the order they got their value,
+            # results are in the order of DATA
+            positions = POSITIONS.get(s_class, {})
+            ids = sorted(ids, key=lambda i: positions.get(i, -1))
+        # Candidates are checked on every attribute again, in case an
+        # object changed since it was saved
+        candidates = [objs[i] for i in ids if i in objs]
+        return list(filter(_search, candidates))
+
+    def explain(self, cls, attributes: dict) -> dict:
+        """ Describe the plan of a search: the indexes used, from the most
+        selective, the number of candidates they leave and the attributes
+        only checked on them
+        """
+        return cls._plan(attributes)[0]
+
+
+class SQLiteEngine():
+    """ Storage engine keeping the objects of every class in a table of a
+    SQLite database in WAL mode: one row per object, holding its JSON, and
+    an index on the JSON value of each __indexes__ attribute.
+
+    Every thread has its own connection, and every change is committed
+    on its own. A table is filled from the JSON files of its class the
+    first time it is loaded empty.
+    """
+
+    def __init__(self, db_path: str = None):
+        """ Initialize the engine of the db_path database
+        """
+        self.db_path = db_path or SQLITE_PATH
+        self.local = threading.local()
+        self.tables = set()
+
+    def connection(self) -> sqlite3.Connection:
+        """ Return the connection of the current thread
+        """
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def table(self, cls) -> str:
+        """ Return the quoted table name of a class, created with its
+        indexes if needed
+        """
+        name = '"{}"'.format(cls.__name__)
+        if cls.__name__ in self.tables:
+            return name
+        conn = self.connection()
+        conn.execute("CREATE TABLE IF NOT EXISTS {} "
+                     "(id TEXT PRIMARY KEY, obj TEXT NOT NULL)".format(name))
+        for attr in cls.__indexes__:
+            conn.execute('CREATE INDEX IF NOT EXISTS "{}_{}" ON {} ({})'
+                         .format(cls.__name__, attr, name, self.column(attr)))
+        self.tables.add(cls.__name__)
+        return name
+
+    @staticmethod
+    def column(attr: str) -> str:
+        """ Return the SQL expression of an attribute, the same as in its
+        index so that SQLite uses it
+        """
+        return "json_extract(obj, '$.{}')".format(attr)
+
+    def load(self, cls):
+        """ Create the table of a class, and import its JSON files when the
+        table is empty
+        """
+        s_class = cls.__name__
+        table = self.table(cls)
+        if self.count(cls) > 0 or not (
+                path.exists(".db_{}.json".format(s_class)) or
+                path.exists(".db_{}.journal".format(s_class))):
+            return
+        JSONFileEngine().load(cls)
+        rows = [(obj_id, json.dumps(obj.to_json(True)))
+                for obj_id, obj in DATA[s_class].items()]
+        DATA[s_class] = cls.new_objects()
+        conn = self.connection()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany("INSERT OR IGNORE INTO {} (id, obj) "
+                             "VALUES (?, ?)".format(table), rows)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def save(self, obj: Base):
+        """ Insert or update the row of an object
+        """
+        self.connection().execute(
+            "INSERT INTO {} (id, obj) VALUES (?, ?) ON CONFLICT (id) "
+            "DO UPDATE SET obj = excluded.obj".format(
+                self.table(obj.__class__)),
+            (obj.id, json.dumps(obj.to_json(True))))
+
+    def remove(self, obj: Base):
+        """ Delete the row of an object
+        """
+        self.connection().execute(
+            "DELETE FROM {} WHERE id = ?".format(self.table(obj.__class__)),
+            (obj.id,))
+
+    def count(self, cls) -> int:
+        """ Count all objects
+        """
+        return self.connection().execute(
+            "SELECT COUNT(*) FROM {}".format(self.table(cls))).fetchone()[0]
+
+    def get(self, cls, id: str) -> Base:
+        """ Return one object by ID
+        """
+        row = self.connection().execute(
+            "SELECT obj FROM {} WHERE id = ?".format(self.table(cls)),
+            (id,)).fetchone()
+        return cls(**json.loads(row[0])) if row is not None else None
+
+    def search(self, cls, attributes: dict) -> List[Base]:
+        """ Search all objects with matching attributes: the conditions SQL
+        can evaluate are in the query, the others checked on its objects
+        """
+        query, params, others = self.query(cls, attributes)
+        objs = [cls(**json.loads(obj_json)) for obj_json, in
+                self.connection().execute(query, params)]
+        if others:
+            objs = [obj for obj in objs if obj.matches(others)]
+        return objs
+
+    def explain(self, cls, attributes: dict) -> dict:
+        """ Describe the plan of a search: its query, the plan of SQLite
+        and the attributes checked on the objects it returns
+        """
+        query, params, others = self.query(cls, attributes)
+        plan = self.connection().execute(
+            "EXPLAIN QUERY PLAN {}".format(query), params).fetchall()
+        return {
+            'strategy': 'sqlite',
+            'query': query,
+            'plan': [row[-1] for row in plan],
+            'scan': list(others),
+        }
+
+    def query(self, cls, attributes: dict) -> tuple:
+        """ Return the query of a search, its parameters and the attributes
+        left to check on the objects
+        """
+        clauses, params, others = [], [], {}
+        for k, v in attributes.items():
+            clause = None
+            if k.isidentifier() and self.is_field(cls, k):
+                clause = self.condition(self.column(k), v, params)
+            if clause is None:
+                others[k] = v
+            else:
+                clauses.append(clause)
+        query = "SELECT obj FROM {}".format(self.table(cls))
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        return query + " ORDER BY rowid", params, others
+
+    @staticmethod
+    def is_field(cls, attr: str) -> bool:
+        """ Return whether an attribute is serialized by to_json, unlike a
+        property
+        """
+        if not hasattr(cls, attr):
             return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+        return isinstance(getattr(cls, attr),
+                          (Timestamp, MemberDescriptorType))
+
+    def condition(self, column: str, value, params: list) -> str:
+        """ Return the SQL condition of a search value, adding its
+        parameters to params, or None when SQL cannot evaluate it
+        """
+        if isinstance(value, In):
+            values = [self.sql_value(v) for v in value.values]
+            if any(v is NotImplemented for v in values):
+                return None
+            clauses = []
+            if any(v is None for v in values):
+                clauses.append("{} IS NULL".format(column))
+            values = [v for v in values if v is not None]
+            if values:
+                clauses.append("{} IN ({})".format(
+                    column, ", ".join("?" * len(values))))
+                params.extend(values)
+            return "({})".format(" OR ".join(clauses)) if clauses else "0"
+        if isinstance(value, Range):
+            bounds = [self.sql_value(value.low), self.sql_value(value.high)]
+            if NotImplemented in bounds:
+                return None
+            clauses = ["{} IS NOT NULL".format(column)]
+            if bounds[0] is not None:
+                clauses.append("{} >= ?".format(column))
+                params.append(bounds[0])
+            if bounds[1] is not None:
+                clauses.append("{} < ?".format(column))
+                params.append(bounds[1])
+            return " AND ".join(clauses)
+        if isinstance(value, Prefix):
+            params.extend([len(value.prefix), value.prefix])
+            return "(typeof({0}) = 'text' AND substr({0}, 1, ?) = ?)".format(
+                column)
+        if isinstance(value, Predicate):
+            return None
+        value = self.sql_value(value)
+        if value is NotImplemented:
+            return None
+        if value is None:
+            return "{} IS NULL".format(column)
+        params.append(value)
+        return "{} = ?".format(column)
+
+    @staticmethod
+    def sql_value(value):
+        """ Return the SQL value of a JSON value, NotImplemented when there
+        is none
+        """
+        if type(value) is datetime:
+            return encode_timestamp(value)
+        if value is None or type(value) in (str, int, float, bool):
+            return value
+        return NotImplemented
+
+
+# Storage engines by name, and the engine in use
+ENGINES = {"json": JSONFileEngine, "sqlite": SQLiteEngine}
+ENGINE = None
+
+
+def get_engine():
+    """ Return the storage engine, STORAGE_ENGINE unless set with
+    set_engine()
+    """
+    global ENGINE
+    if ENGINE is None:
+        ENGINE = ENGINES[STORAGE_ENGINE]()
+    return ENGINE
+
+
+def set_engine(engine):
+    """ Use another storage engine, e.g. SQLiteEngine("test.db")
+    """
+    global ENGINE
+    ENGINE = engine
@@ -2,13 +2,16 @@
 """ User module
 """
 import hashlib
-from models.base import Base
+from models.base import Base, slots
 
 
 class User(Base):
     """ User class
     """
 
+    __indexes__ = ('email', 'first_name', 'last_name')
+    __slots__ = slots('email', '_password', 'first_name', 'last_name')
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a User instance
         """
@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 """Module for user session
 """
-from models.base import Base
+from models.base import Base, slots
 
 
 class UserSession(Base):
     """User session class.
     """
 
+    __indexes__ = ('session_id', 'user_id')
+    __slots__ = slots('user_id', 'session_id')
+
     def __init__(self, *args: list, **kwargs: dict):
         """Initializes a User session instance.
         """
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+""" Benchmark of the timestamp codec of models.base
+
+Times decoding and encoding TIMESTAMP_FORMAT timestamps with
+strptime/strftime and with the codec, then loading and serializing User
+objects with strptime/strftime, the codec and lazy timestamps, and checks
+the serialized objects are the ones loaded. Usage:
+
+    ./timestamp_benchmark.py --objects 1000000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from models import base
+from models.user import User
+
+
+# Objects generated once and processed again until the count is reached
+CHUNK_SIZE = 10000
+
+
+def generate_objects(count: int, seed: int = 0) -> list:
+    """ Generate the serialized form of count users
+    """
+    rng = random.Random(seed)
+    start = datetime(2017, 1, 1)
+    objs = []
+    for i in range(count):
+        created_at = start + timedelta(seconds=rng.randrange(10 ** 8))
+        updated_at = created_at + timedelta(seconds=rng.randrange(10 ** 6))
+        objs.append({
+            'id': "{:08d}".format(i),
+            'created_at': created_at.strftime(base.TIMESTAMP_FORMAT),
+            'updated_at': updated_at.strftime(base.TIMESTAMP_FORMAT),
+            'email': "user{}@example.com".format(i),
+            '_password': None,
+            'first_name': "First{}".format(i % 100),
+            'last_name': "Last{}".format(i % 1000),
+        })
+    return objs
+
+
+def measure(run, chunk: list, count: int) -> float:
+    """ Return the objects per second of run over count objects
+    """
+    seconds, done = 0.0, 0
+    while done < count:
+        part = chunk[:count - done]
+        start = time.perf_counter()
+        run(part)
+        seconds += time.perf_counter() - start
+        done += len(part)
+    return done / seconds
+
+
+def decode_strptime(objs: list):
+    """ Decode the timestamps of objs with datetime.strptime
+    """
+    for obj in objs:
+        datetime.strptime(obj['created_at'], base.TIMESTAMP_FORMAT)
+        datetime.strptime(obj['updated_at'], base.TIMESTAMP_FORMAT)
+
+
+def decode_codec(objs: list):
+    """ Decode the timestamps of objs with the codec
+    """
+    for obj in objs:
+        base.decode_timestamp(obj['created_at'])
+        base.decode_timestamp(obj['updated_at'])
+
+
+def main(count: int):
+    """ Run and print every measure
+    """
+    chunk = generate_objects(min(count, CHUNK_SIZE))
+    dates = [datetime.strptime(obj['created_at'], base.TIMESTAMP_FORMAT)
+             for obj in chunk]
+    results = [
+        ("decode strptime", measure(decode_strptime, chunk, count)),
+        ("decode codec", measure(decode_codec, chunk, count)),
+        ("encode strftime", measure(
+            lambda part: [d.strftime(base.TIMESTAMP_FORMAT)
+                          for d in dates[:len(part)] * 2],
+            chunk, count)),
+        ("encode codec", measure(
+            lambda part: [base.encode_timestamp(d)
+                          for d in dates[:len(part)] * 2],
+            chunk, count)),
+    ]
+    codec = (base.decode_timestamp, base.encode_timestamp)
+    strptime = (
+        lambda text: datetime.strptime(text, base.TIMESTAMP_FORMAT),
+        lambda value: value.strftime(base.TIMESTAMP_FORMAT))
+    modes = (("strptime", "eager", strptime), ("eager", "eager", codec),
+             ("lazy", "lazy", codec))
+    for mode, timestamps, (decode, encode) in modes:
+        base.TIMESTAMPS = timestamps
+        base.decode_timestamp, base.encode_timestamp = decode, encode
+        users = [User(**obj) for obj in chunk]
+        if [user.to_json(True) for user in users] != chunk:
+            raise AssertionError("{} output differs".format(mode))
+        results.append(("load {}".format(mode), measure(
+            lambda part: [User(**obj) for obj in part], chunk, count)))
+        results.append(("load+to_json {}".format(mode), measure(
+            lambda part: [User(**obj).to_json(True) for obj in part],
+            chunk, count)))
+    for name, rate in results:
+        print("{:<20} {:>12.0f} objects/s".format(name, rate))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the timestamp codec of models.base.")
+    parser.add_argument("--objects", type=int, default=1000000,
+                        help="objects per measure")
+    main(parser.parse_args().objects)